@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+import pytest
+
+# the examples import their helpers from their own directory, the way running a script from there does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def distributed_json(local_ips, member_ids=None, me=0):
+    """Return the contents of a `distributed.json` with a member per IP in `local_ips`, written from member `me`."""
+    member_ids = member_ids or [str(index) for index in range(len(local_ips))]
+    members = [
+        {
+            'announce_time': '2022-01-01T00:00:00',
+            'identity': f'worker-{member_id}',
+            'job_id': f'job-{member_id}',
+            'member_id': member_id,
+            'network': {'exposed_ports': {}, 'local_ips': [ip], 'public_ips': []},
+        }
+        for member_id, ip in zip(member_ids, local_ips)
+    ]
+    return {
+        'config': {'group_name': 'task-test', 'member_id': member_ids[me], 'required_count': len(members)},
+        'members': members,
+    }
+
+
+@pytest.fixture
+def load_config(tmp_path, monkeypatch):
+    """Write a `distributed_json()` under `VH_CONFIG_DIR` and return a `cluster_config.load()` of it."""
+    import cluster_config
+
+    def load(*args, **kwargs):
+        with open(tmp_path / 'distributed.json', 'w') as fp:
+            json.dump(distributed_json(*args, **kwargs), fp)
+        monkeypatch.setenv('VH_CONFIG_DIR', str(tmp_path))
+        cluster_config.install(None)
+        return cluster_config.load()
+
+    yield load
+    cluster_config.install(None)
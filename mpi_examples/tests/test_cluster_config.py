@@ -0,0 +1,87 @@
+import json
+import pickle
+
+import pytest
+
+import cluster_config
+from conftest import distributed_json
+
+
+def synthetic(count, members_per_host=1, me=0, shuffle=True):
+    """A group of `count` members on `count / members_per_host` hosts, listed out of rank order."""
+    hosts = [index // members_per_host for index in range(count)]
+    ips = [f'10.{host // 65536}.{host // 256 % 256}.{host % 256}' for host in hosts]
+    data = distributed_json(ips, me=me)
+    if shuffle:
+        data['members'].reverse()
+    return data
+
+
+@pytest.mark.parametrize('count', [1, 2, 100, 10000])
+def test_indexes(count):
+    config = cluster_config.ClusterConfig.from_json_data(synthetic(count, me=count - 1))
+    assert len(config) == count
+    assert config.master.rank == 0 and config.master.member_id == '0'
+    assert config.me.rank == count - 1 and config.rank == count - 1
+    for rank in {0, count // 2, count - 1}:
+        member = config.by_rank(rank)
+        assert member.rank == rank
+        assert member.member_id == str(rank)
+        assert config.by_member_id(str(rank)) is member
+        assert config.by_ip(member.primary_local_ip) == [member]
+    assert config.primary_local_ips == [m.primary_local_ip for m in config.members]
+
+
+def test_ranks_follow_numeric_member_ids():
+    data = distributed_json(['a', 'b', 'c'], member_ids=['10', '9', '100'])
+    config = cluster_config.ClusterConfig.from_json_data(data)
+    assert [m.member_id for m in config.members] == ['9', '10', '100']
+
+
+def test_ranks_follow_text_member_ids():
+    config = cluster_config.ClusterConfig.from_json_data(distributed_json(['a', 'b'], member_ids=['b-1', 'a-2']))
+    assert [m.member_id for m in config.members] == ['a-2', 'b-1']
+
+
+def test_unknown_member_id():
+    config = cluster_config.ClusterConfig.from_json_data(synthetic(3))
+    with pytest.raises(RuntimeError, match='no-such'):
+        config.by_member_id('no-such')
+    assert config.by_ip('192.0.2.1') == []
+
+
+@pytest.mark.parametrize('count', [1, 6, 10000])
+def test_host_groupings_of_members_sharing_machines(count):
+    config = cluster_config.ClusterConfig.from_json_data(synthetic(count, members_per_host=2))
+    assert config.by_ip(config.master.primary_local_ip) == list(config.members[:min(2, count)])
+    groups = config.host_ranks(nproc_per_node=3)
+    assert sum(len(ranks) for ranks in groups.values()) == count * 3
+    assert list(groups.values())[0] == list(range(min(2, count) * 3))
+    hosts = config.rank_hosts(nproc_per_node=3)
+    assert len(hosts) == count * 3
+    assert all(hosts[rank] == ip for ip, ranks in groups.items() for rank in ranks)
+
+
+@pytest.mark.parametrize('count', [1, 100, 10000])
+def test_pickles_compactly(count):
+    config = cluster_config.ClusterConfig.from_json_data(synthetic(count, me=count // 2))
+    data = pickle.dumps(config)
+    restored = pickle.loads(data)
+    assert restored.members == config.members
+    assert restored.me == config.me
+    assert (restored.group_name, restored.required_count) == (config.group_name, config.required_count)
+    # about as small as the JSON it was parsed from, not an object graph per member
+    assert len(data) < len(json.dumps(synthetic(count)))
+
+
+def test_load_reads_the_file_only_once(load_config, tmp_path):
+    config = load_config(['10.0.0.1', '10.0.0.2'])
+    (tmp_path / 'distributed.json').write_text('not json')
+    assert cluster_config.load() is config
+
+
+def test_install_replaces_the_loaded_config(load_config):
+    load_config(['10.0.0.1'])
+    received = pickle.loads(pickle.dumps(cluster_config.ClusterConfig.from_json_data(synthetic(5))))
+    cluster_config.install(received)
+    assert cluster_config.load() is received
@@ -0,0 +1,92 @@
+import pytest
+
+from topology import format_cpulist, order_members, parse_cpulist, plan_placement
+
+IPS = ['10.0.0.10', '10.0.0.9', '10.0.1.2', '10.0.0.2']
+
+
+def single_node(cpu_count):
+    cpus = list(range(cpu_count))
+    return {'cpus': cpus, 'numa_nodes': [cpus]}
+
+
+def two_nodes():
+    return {'cpus': [0, 1, 2, 3], 'numa_nodes': [[0, 1], [2, 3]]}
+
+
+def test_cpulist_round_trip():
+    assert parse_cpulist('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpulist([11, 0, 1, 2, 3, 8, 10]) == '0-3,8,10-11'
+
+
+def test_hosts_are_ordered_master_first_then_by_address(load_config):
+    config = load_config(IPS)
+    assert [m.primary_local_ip for m in order_members(config.members)] == [
+        '10.0.0.10', '10.0.0.2', '10.0.0.9', '10.0.1.2',
+    ]
+
+
+def test_fixed_processes_without_binding(load_config):
+    config = load_config(IPS)
+    hosts, rankfile = plan_placement(config.members, {}, processes_per_host='2')
+    assert hosts == [('10.0.0.10', 2), ('10.0.0.2', 2), ('10.0.0.9', 2), ('10.0.1.2', 2)]
+    assert rankfile is None
+
+
+def test_auto_processes_bound_to_cores(load_config):
+    config = load_config(IPS[:2])
+    topologies = {'10.0.0.10': single_node(2), '10.0.0.9': single_node(3)}
+    hosts, rankfile = plan_placement(config.members, topologies, processes_per_host='auto', bind_to='core')
+    assert hosts == [('10.0.0.10', 2), ('10.0.0.9', 3)]
+    assert rankfile == [
+        'rank 0=10.0.0.10 slot=0',
+        'rank 1=10.0.0.10 slot=1',
+        'rank 2=10.0.0.9 slot=0',
+        'rank 3=10.0.0.9 slot=1',
+        'rank 4=10.0.0.9 slot=2',
+    ]
+
+
+def test_cores_are_split_between_fewer_ranks(load_config):
+    config = load_config(IPS[:1])
+    _, rankfile = plan_placement(config.members, {'10.0.0.10': single_node(8)}, processes_per_host='2', bind_to='core')
+    assert rankfile == ['rank 0=10.0.0.10 slot=0-3', 'rank 1=10.0.0.10 slot=4-7']
+
+
+def test_auto_processes_bound_to_numa_nodes(load_config):
+    config = load_config(IPS[:2])
+    topologies = {ip: two_nodes() for ip in IPS[:2]}
+    hosts, rankfile = plan_placement(config.members, topologies, processes_per_host='auto', bind_to='numa')
+    assert hosts == [('10.0.0.10', 2), ('10.0.0.9', 2)]
+    assert rankfile == [
+        'rank 0=10.0.0.10 slot=0-1',
+        'rank 1=10.0.0.10 slot=2-3',
+        'rank 2=10.0.0.9 slot=0-1',
+        'rank 3=10.0.0.9 slot=2-3',
+    ]
+
+
+def test_neighbouring_ranks_share_a_numa_node(load_config):
+    config = load_config(IPS[:1])
+    _, rankfile = plan_placement(config.members, {'10.0.0.10': two_nodes()}, processes_per_host='4', bind_to='numa')
+    assert [line.split('slot=')[1] for line in rankfile] == ['0-1', '0-1', '2-3', '2-3']
+
+
+def test_rankfile_follows_the_master_of_the_loaded_config(load_config):
+    # the same group seen from another member still puts the master's ranks first
+    config = load_config(IPS[:2], me=1)
+    topologies = {ip: single_node(1) for ip in IPS[:2]}
+    _, rankfile = plan_placement(config.members, topologies, processes_per_host='auto', bind_to='core')
+    assert rankfile == ['rank 0=10.0.0.10 slot=0', 'rank 1=10.0.0.9 slot=0']
+
+
+def test_missing_topology(load_config):
+    config = load_config(IPS[:2])
+    with pytest.raises(ValueError, match='10.0.0.9'):
+        plan_placement(config.members, {'10.0.0.10': single_node(2)}, processes_per_host='auto')
+
+
+def test_more_ranks_than_cores(load_config):
+    config = load_config(IPS[:1])
+    with pytest.raises(ValueError, match='3 ranks'):
+        plan_placement(config.members, {'10.0.0.10': single_node(2)}, processes_per_host='3', bind_to='core')
@@ -0,0 +1,78 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from run_mpirun import probe, serve_control, wait_until_ready
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def ready_address():
+    server = serve_control(free_port())
+    yield '127.0.0.1', server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def silent_address():
+    # accepts connections but never answers them, like a port some other service listens on
+    server = socket.create_server(('127.0.0.1', 0))
+    yield '127.0.0.1', server.getsockname()[1]
+    server.close()
+
+
+def test_probe_ready(ready_address):
+    assert probe(ready_address)
+
+
+def test_probe_closed_port():
+    assert not probe(('127.0.0.1', free_port()), timeout=0.5)
+
+
+def test_probe_listener_that_never_answers(silent_address):
+    assert not probe(silent_address, timeout=0.2)
+
+
+def test_wait_until_ready_returns_once_all_ready(ready_address):
+    other = serve_control(free_port())
+    start = time.monotonic()
+    wait_until_ready([ready_address, ('127.0.0.1', other.getsockname()[1])], deadline=5)
+    assert time.monotonic() - start < 1
+    other.close()
+
+
+def test_wait_until_ready_waits_for_a_late_listener():
+    port = free_port()
+    servers = []
+    timer = threading.Timer(0.3, lambda: servers.append(serve_control(port)))
+    timer.start()
+    try:
+        wait_until_ready([('127.0.0.1', port)], deadline=5, initial_backoff=0.01)
+    finally:
+        timer.join()
+        for server in servers:
+            server.close()
+
+
+def test_wait_until_ready_names_the_hosts_that_never_came_up(ready_address, silent_address):
+    closed = ('127.0.0.1', free_port())
+    start = time.monotonic()
+    with pytest.raises(TimeoutError) as error:
+        wait_until_ready([ready_address, closed, silent_address], deadline=0.5, connect_timeout=0.1)
+    assert time.monotonic() - start < 2
+    message = str(error.value)
+    assert '2 host(s)' in message
+    assert f'127.0.0.1:{closed[1]}' in message
+    assert f'127.0.0.1:{silent_address[1]}' in message
+    assert f'127.0.0.1:{ready_address[1]}' not in message
+
+
+def test_wait_until_ready_without_workers():
+    wait_until_ready([], deadline=0)
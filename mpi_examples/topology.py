@@ -0,0 +1,108 @@
+import glob
+import ipaddress
+import os
+
+
+def parse_cpulist(text):
+    """Parse a Linux CPU list such as `0-3,8-11` into a list of CPU ids."""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """Format CPU ids as a compact list such as `0-3,8-11`."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else f'{first}-{last}' for first, last in ranges)
+
+
+def detect_local_topology(sysfs='/sys/devices/system/node'):
+    """
+    Describe the CPUs this process may run on, grouped by NUMA node.
+
+    Returns `{'cpus': [...], 'numa_nodes': [[...], ...]}`; without NUMA information all CPUs form one node.
+    """
+    allowed = sorted(os.sched_getaffinity(0))
+    numa_nodes = []
+    paths = glob.glob(os.path.join(sysfs, 'node[0-9]*', 'cpulist'))
+    for path in sorted(paths, key=lambda p: int(os.path.basename(os.path.dirname(p))[len('node'):])):
+        with open(path) as fp:
+            cpus = [cpu for cpu in parse_cpulist(fp.read()) if cpu in allowed]
+        if cpus:
+            numa_nodes.append(cpus)
+    if not numa_nodes:
+        numa_nodes = [allowed]
+    return {'cpus': [cpu for node in numa_nodes for cpu in node], 'numa_nodes': numa_nodes}
+
+
+def order_members(members):
+    """
+    Order members so MPI ranks fill the master first and then the other hosts by IP address.
+
+    Consecutive ranks land on the same host, and hosts next to each other in the address space (usually
+    the same subnet or rack) get consecutive rank ranges, which keeps most ring neighbours close.
+    """
+    def key(member):
+        return not member.is_master, ipaddress.ip_address(member.primary_local_ip)
+
+    return sorted(members, key=key)
+
+
+def slots_for(topology, processes_per_host, bind_to):
+    if processes_per_host != 'auto':
+        return int(processes_per_host)
+    if bind_to == 'numa':
+        return len(topology['numa_nodes'])
+    return len(topology['cpus'])
+
+
+def _rank_cpus(topology, slots, bind_to):
+    """Split a host's CPUs into `slots` contiguous sets, one per local rank, for the given binding."""
+    if bind_to == 'numa':
+        nodes = topology['numa_nodes']
+        # contiguous blocks of local ranks share a NUMA node
+        return [nodes[local_rank * len(nodes) // slots] for local_rank in range(slots)]
+    cpus = topology['cpus']
+    if slots > len(cpus):
+        raise ValueError(f'cannot bind {slots} ranks to their own cores on a host with {len(cpus)} CPUs')
+    return [cpus[local_rank * len(cpus) // slots:(local_rank + 1) * len(cpus) // slots] for local_rank in range(slots)]
+
+
+def plan_placement(members, topologies, processes_per_host=1, bind_to='none'):
+    """
+    Plan where MPI ranks run.
+
+    `topologies` maps a member's `primary_local_ip` to `detect_local_topology()` output of that host
+    and is only needed for `processes_per_host='auto'` or a binding.
+    Returns the `(ip, slots)` host list in rank order, and the rankfile lines for `bind_to` of
+    `'numa'` or `'core'` (`None` for `'none'`), with physical CPU ids.
+    """
+    hosts = []
+    rankfile = [] if bind_to != 'none' else None
+    rank = 0
+    for member in order_members(members):
+        ip = member.primary_local_ip
+        topology = topologies.get(ip)
+        if topology is None and (processes_per_host == 'auto' or bind_to != 'none'):
+            raise ValueError(f'no topology known for host {ip}')
+        slots = slots_for(topology, processes_per_host, bind_to)
+        hosts.append((ip, slots))
+        if rankfile is not None:
+            for cpus in _rank_cpus(topology, slots, bind_to):
+                rankfile.append(f'rank {rank}={ip} slot={format_cpulist(cpus)}')
+                rank += 1
+        else:
+            rank += slots
+    return hosts, rankfile
@@ -1,31 +1,29 @@
+import argparse
+import functools
+
 import torch
 import torch.distributed as dist
-import torch.multiprocessing as mp
-import valohai
-
 
-def run(my_rank, world_size):
-    group = dist.new_group(list(range(world_size)))
-    tensor = torch.ones(1)
-    dist.all_reduce(tensor, op=dist.ReduceOp.SUM, group=group)
-    print(f'Rank {my_rank} has data {tensor} on host {valohai.distributed.me().identity}')
+import cluster_config
+from collectives import add_all_reduce_argument, build_all_reduce, new_group
+from launcher import add_launch_arguments, launch
 
 
-def init(master_url, my_rank, world_size, fn):
-    dist.init_process_group(init_method=master_url, rank=my_rank, world_size=world_size, backend='gloo')
-    fn(my_rank, world_size)
+def run(my_rank, world_size, settings):
+    tensor = torch.ones(1)
+    if settings.all_reduce == 'hierarchical':
+        all_reduce = build_all_reduce(settings.all_reduce, settings.nproc_per_node)
+        all_reduce(tensor)
+    else:
+        group = new_group(range(world_size))
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM, group=group)
+    print(f'Rank {my_rank} has data {tensor} on host {cluster_config.load().me.identity}')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_launch_arguments(parser)
+    add_all_reduce_argument(parser)
+    settings = parser.parse_args()
 
-    master_port = 1234
-    master_ip = valohai.distributed.master().primary_local_ip
-    url = f"tcp://{master_ip}:{master_port}"
-
-    size = valohai.distributed.required_count
-    rank = valohai.distributed.me().rank
-
-    mp.set_start_method('spawn')
-    p = mp.Process(target=init, args=(url, rank, size, run))
-    p.start()
-    p.join()
+    launch(functools.partial(run, settings=settings), backend='gloo', settings=settings)
@@ -1,151 +1,388 @@
 # Source: https://pytorch.org/tutorials/intermediate/dist_tuto.html
 
-import math
-from random import Random
+import argparse
+import functools
 
 import torch
 import torch.distributed as dist
-import torch.multiprocessing as mp
-import torch.nn as nn
-import torch.nn.functional as F
-import valohai
 from torch import optim
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader
 from torchvision import datasets, transforms
 
+from checkpointing import AsyncCheckpointer, load_latest, resume_position
+from collectives import add_all_reduce_argument, build_all_reduce
+from compression import add_compression_arguments, build_compression
+from evaluation import add_evaluation_arguments, evaluate, log_metrics
+from gradient_sync import GradientBucketer, average_gradients
+from launcher import add_launch_arguments, launch
+from local_sgd import PeriodicAverager, add_local_sgd_arguments
+from mnist_cache import MNIST_MEAN, MNIST_STD, cached_mnist
+from models import Net
+from partitioning import DistributedEpochSampler, StridedSampler
+from profiling import StepProfiler, add_profiling_arguments
+from sharded_dataset import sharded_mnist
+from sharded_optimizer import ShardedOptimizer
+from training_modes import add_training_mode_arguments, autocast, build_loss_fn
 
-class Net(nn.Module):
-
-    def __init__(self):
-        super(Net, self).__init__()
-        self.conv1 = nn.Conv2d(1, 32, 3, 1)
-        self.conv2 = nn.Conv2d(32, 64, 3, 1)
-        self.dropout1 = nn.Dropout(0.25)
-        self.dropout2 = nn.Dropout(0.5)
-        self.fc1 = nn.Linear(9216, 128)
-        self.fc2 = nn.Linear(128, 10)
-
-    def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        x = F.max_pool2d(x, 2)
-        x = self.dropout1(x)
-        x = torch.flatten(x, 1)
-        x = self.fc1(x)
-        x = F.relu(x)
-        x = self.dropout2(x)
-        x = self.fc2(x)
-        output = F.log_softmax(x, dim=1)
-        return output
-
-
-class Partition:
-
-    def __init__(self, data, index):
-        self.data = data
-        self.index = index
-
-    def __len__(self):
-        return len(self.index)
-
-    def __getitem__(self, index):
-        data_idx = self.index[index]
-        return self.data[data_idx]
-
-
-class DataPartitioner:
-
-    def __init__(self, dataset, sizes=None, seed=1234):
-        if sizes is None:
-            sizes = [0.7, 0.2, 0.1]
-        self.data = dataset
-        self.partitions = []
-        rng = Random()
-        rng.seed(seed)
-        data_len = len(dataset)
-        indexes = [x for x in range(0, data_len)]
-        rng.shuffle(indexes)
-        for frac in sizes:
-            part_len = int(frac * data_len)
-            self.partitions.append(indexes[0:part_len])
-            indexes = indexes[part_len:]
-
-    def use(self, partition):
-        return Partition(self.data, self.partitions[partition])
-
-
-def partition_dataset():
-    dataset = datasets.MNIST(
+
+def load_dataset(settings, train=True):
+    if settings.data_source == 'cache':
+        return cached_mnist(root='./data', cache_dir=settings.cache_dir, train=train)
+    return datasets.MNIST(
         root='./data',
-        train=True,
+        train=train,
         download=True,
         transform=transforms.Compose([
             transforms.ToTensor(),
-            transforms.Normalize((0.1307,), (0.3081,))
+            transforms.Normalize((MNIST_MEAN,), (MNIST_STD,))
         ]),
     )
+
+
+def partition_dataset(settings):
     size = dist.get_world_size()
     bsz = int(128 / float(size))
-    partition_sizes = [1.0 / size for _ in range(size)]
-    partition = DataPartitioner(dataset, partition_sizes)
-    partition = partition.use(dist.get_rank())
-    train_set = DataLoader(
-        partition,
-        batch_size=bsz,
-        shuffle=True,
-    )
-    return train_set, bsz
+    if settings.data_source == 'shards':
+        # streams this rank's shards and batches by itself, it also stands in for the sampler
+        dataset = sharded_mnist(
+            root='./data',
+            directory=settings.shard_dir,
+            batch_size=bsz,
+            rank=dist.get_rank(),
+            num_replicas=size,
+            num_workers=settings.loader_workers,
+            shuffle_buffer=settings.shuffle_buffer,
+        )
+        train_set = DataLoader(dataset, batch_size=None, num_workers=settings.loader_workers)
+        return train_set, bsz, dataset
+    dataset = load_dataset(settings)
+    sampler = DistributedEpochSampler(dataset, num_replicas=size, rank=dist.get_rank(), drop_last=settings.drop_last)
+    # a loader draws a seed for its workers on every epoch; keep that off the global RNG that checkpoints restore
+    generator = torch.Generator()
+    if settings.fetch == 'batch':
+        # the dataset returns whole collated batches itself, so the loader must not batch again
+        train_set = DataLoader(
+            dataset,
+            batch_size=None,
+            sampler=BatchSampler(sampler, batch_size=bsz, drop_last=False),
+            num_workers=settings.loader_workers,
+            generator=generator,
+        )
+    else:
+        train_set = DataLoader(
+            dataset,
+            batch_size=bsz,
+            sampler=sampler,
+            num_workers=settings.loader_workers,
+            generator=generator,
+        )
+    return train_set, bsz, sampler
 
 
-def average_gradients(model):
-    size = float(dist.get_world_size())
-    for param in model.parameters():
-        dist.all_reduce(param.grad.data, op=dist.ReduceOp.SUM)
-        param.grad.data /= size
+def evaluation_set(settings):
+    # the shards only hold the training set, so they evaluate on the torchvision test set
+    dataset = load_dataset(settings, train=False)
+    sampler = StridedSampler(dataset, num_replicas=dist.get_world_size(), rank=dist.get_rank())
+    if settings.data_source == 'cache':
+        return DataLoader(
+            dataset,
+            batch_size=None,
+            sampler=BatchSampler(sampler, batch_size=settings.eval_batch_size, drop_last=False),
+            num_workers=settings.loader_workers,
+        )
+    return DataLoader(
+        dataset,
+        batch_size=settings.eval_batch_size,
+        sampler=sampler,
+        num_workers=settings.loader_workers,
+    )
 
 
-def run(my_rank, world_size):
+def run(my_rank, world_size, settings):
     torch.manual_seed(1234)
-    train_set, bsz = partition_dataset()
+    train_set, bsz, sampler = partition_dataset(settings)
+    eval_set = evaluation_set(settings) if settings.eval_every else None
     model = Net()
-    optimizer = optim.SGD(
-        model.parameters(),
-        lr=0.01,
-        momentum=0.5,
-    )
-    num_batches = math.ceil(len(train_set.dataset) / float(bsz))
-    for epoch in range(2):
+    sharded = settings.optimizer_state == 'sharded'
+    if sharded:
+        # moves the parameters into one flat buffer, so it goes before anything holding on to them
+        optimizer = ShardedOptimizer(model.parameters(), optim.SGD, lr=0.01, momentum=0.5)
+    else:
+        optimizer = optim.SGD(
+            model.parameters(),
+            lr=0.01,
+            momentum=0.5,
+        )
+    loss_fn = build_loss_fn(model, settings.compile)
+    all_reduce = build_all_reduce(settings.all_reduce, settings.nproc_per_node)
+    compression = build_compression(settings.compression, topk_ratio=settings.topk_ratio)
+    bucketer = None
+    if settings.gradient_sync == 'bucketed' and not sharded:
+        bucketer = GradientBucketer(
+            model.parameters(),
+            bucket_size_mb=settings.bucket_size_mb,
+            all_reduce=all_reduce,
+            compression=compression,
+        )
+    averager = None
+    if settings.local_steps > 1:
+        averager = PeriodicAverager(
+            model,
+            optimizer,
+            period=settings.local_steps,
+            warmup_steps=settings.local_sgd_warmup,
+            average_momentum=settings.average_momentum,
+            all_reduce=all_reduce,
+        )
+    epochs = 2
+    step = 0
+    start_epoch = 0
+    start_batch = 0
+    checkpointer = None
+
+    def save_checkpoint(next_epoch, next_batch):
+        # records where the next step starts from; between local SGD averages rank 0's model stands for all
+        checkpointer.save(
+            step,
+            replicated_state={
+                'model': model.state_dict(),
+                'optimizer': None if sharded else optimizer.state_dict(),
+                'epoch': next_epoch,
+                'batch': next_batch,
+                'sampler_seed': sampler.seed,
+            },
+            local_state={
+                'rng': torch.get_rng_state(),
+                'compression': compression.state_dict(),
+                'optimizer': optimizer.state_dict() if sharded else None,
+            },
+        )
+
+    if settings.checkpoint_every:
+        checkpointer = AsyncCheckpointer(settings.checkpoint_dir, rank=my_rank)
+        resumed = load_latest(settings.checkpoint_dir)
+        if resumed:
+            step, replicated, local = resumed
+            model.load_state_dict(replicated['model'])
+            optimizer.load_state_dict(local['optimizer'] if sharded else replicated['optimizer'])
+            start_epoch, start_batch = replicated['epoch'], replicated['batch']
+            sampler.seed = replicated['sampler_seed']
+            torch.set_rng_state(local['rng'])
+            compression.load_state_dict(local['compression'])
+            print(f'Rank {my_rank} resumed from step {step}, epoch {start_epoch}, batch {start_batch}')
+
+    profiler = None
+    if settings.profile_every:
+        profiler = StepProfiler(
+            log_every=settings.profile_every,
+            straggler_threshold=settings.straggler_threshold,
+            trace_steps=settings.trace_steps,
+            trace_dir=settings.trace_dir,
+            start_step=step,
+        )
+
+    for epoch in range(start_epoch, epochs):
+        first_batch = start_batch if epoch == start_epoch else 0
+        sampler.set_epoch(epoch, offset=first_batch * bsz)
+        num_batches = len(train_set)
+        # with streamed shards the count changes from epoch to epoch
+        batches_per_epoch = first_batch + num_batches
         epoch_loss = 0.0
-        for data, target in train_set:
+        for batch, (data, target) in enumerate(train_set, start=first_batch + 1):
+            if profiler:
+                profiler.mark('data')
+            synchronous = averager is None or averager.synchronizes(step + 1)
+            if bucketer and not synchronous:
+                # the bucketer would start all-reducing gradients from inside backward()
+                bucketer.remove()
+                bucketer = None
             optimizer.zero_grad()
-            output = model(data)
-            loss = F.nll_loss(output, target)
+            with autocast(settings.precision):
+                loss = loss_fn(data, target)
             epoch_loss += loss.item()
+            if profiler:
+                profiler.mark('forward')
             loss.backward()
-            average_gradients(model)
+            if profiler:
+                # with bucketing, communication overlapping the backward pass counts as backward
+                profiler.mark('backward')
+            if sharded:
+                optimizer.synchronize()
+            elif bucketer:
+                bucketer.synchronize()
+            elif synchronous:
+                average_gradients(model, all_reduce=all_reduce, compression=compression)
+            if profiler:
+                profiler.mark('communication')
             optimizer.step()
-        print(f'Rank {dist.get_rank()}, epoch {epoch}: {epoch_loss / num_batches}')
+            if profiler:
+                # with a sharded optimizer this includes all-gathering the updated parameters
+                profiler.mark('optimizer')
+            step += 1
+            if averager and averager.step(step) and profiler:
+                profiler.mark('communication')
+            if checkpointer and step % settings.checkpoint_every == 0:
+                save_checkpoint(*resume_position(epoch, batch, batches_per_epoch))
+                if profiler:
+                    # snapshotting the state for the background writer belongs to no phase
+                    profiler.reset_clock()
+            if profiler:
+                profiler.step_end(step)
+        traffic = [optimizer if sharded else compression] + ([averager] if averager else [])
+        sent_per_step = sum(t.bytes_sent for t in traffic) / max(1, num_batches) / 1024 / 1024
+        for t in traffic:
+            t.bytes_sent = 0
+        print(f'Rank {my_rank}, epoch {epoch}: {epoch_loss / max(1, num_batches)}, sent {sent_per_step:.3f} MB/step')
 
-    torch.save(model.state_dict(), '/valohai/outputs/model_weights.pth')
+        if eval_set is not None and (epoch + 1) % settings.eval_every == 0:
+            if averager:
+                # every rank evaluates its share with the same model
+                averager.average()
+            if checkpointer and step % settings.checkpoint_every:
+                # the checkpoint of the evaluated model is written in the background while evaluating
+                save_checkpoint(epoch + 1, 0)
+            metrics = evaluate(model, eval_set, all_reduce=all_reduce)
+            if my_rank == 0:
+                print(f'Epoch {epoch}: test loss {metrics["loss"]:.4f}, accuracy {metrics["accuracy"]:.4f} '
+                      f'over {metrics["count"]} samples')
+                log_metrics(epoch, metrics)
+            if profiler:
+                profiler.reset_clock()
 
-
-def init(master_url, my_rank, world_size, fn):
-    dist.init_process_group(init_method=master_url, rank=my_rank, world_size=world_size, backend='gloo')
-    fn(my_rank, world_size)
+    if averager:
+        # ranks drift apart between averages, end with the same model everywhere
+        averager.average()
+    if sharded:
+        report = optimizer.memory_report()
+        print(f'Rank {my_rank} holds optimizer state for {report["shard_numel"]} of {report["total_numel"]} '
+              f'parameters: {report["optimizer_state_bytes"] / 1024 / 1024:.3f} MB instead of '
+              f'{report["replicated_state_bytes"] / 1024 / 1024:.3f} MB')
+    if profiler:
+        profiler.close()
+    if checkpointer:
+        checkpointer.wait()
+    # local ranks share the host's outputs directory, so only the first one of them writes the weights
+    if my_rank % settings.nproc_per_node == 0:
+        torch.save(model.state_dict(), '/valohai/outputs/model_weights.pth')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_launch_arguments(parser)
+    add_all_reduce_argument(parser)
+    add_compression_arguments(parser)
+    add_training_mode_arguments(parser)
+    add_profiling_arguments(parser)
+    add_local_sgd_arguments(parser)
+    add_evaluation_arguments(parser)
+    parser.add_argument(
+        '--gradient-sync',
+        required=False,
+        default='bucketed',
+        choices=['bucketed', 'per-parameter'],
+        help='how gradients are averaged across ranks, default: bucketed',
+    )
+    parser.add_argument(
+        '--bucket-size-mb',
+        required=False,
+        default=1.0,
+        type=float,
+        metavar='MEGABYTES',
+        help='the size of a single gradient all-reduce bucket when using bucketed sync, default: 1.0',
+    )
+    parser.add_argument(
+        '--optimizer-state',
+        required=False,
+        default='replicated',
+        choices=['replicated', 'sharded'],
+        help='update all parameters on every rank, or reduce-scatter the gradients, update and keep optimizer '
+             'state for a 1/world_size slice on each rank and all-gather the parameters, default: replicated',
+    )
+    parser.add_argument(
+        '--drop-last',
+        required=False,
+        default=False,
+        action='store_true',
+        help="drop the samples that don't divide evenly across ranks instead of padding with repeated samples",
+    )
+    parser.add_argument(
+        '--data-source',
+        required=False,
+        default='cache',
+        choices=['cache', 'torchvision', 'shards'],
+        help='read pre-normalized samples from a memory-mapped cache, transform them per sample, or stream them '
+             'from binary shards without loading the dataset into memory, default: cache',
+    )
+    parser.add_argument(
+        '--shard-dir',
+        required=False,
+        default='./data/mnist-shards',
+        metavar='DIRECTORY',
+        help='where MNIST is written as binary shards and streamed from with --data-source shards, '
+             'default: ./data/mnist-shards',
+    )
+    parser.add_argument(
+        '--shuffle-buffer',
+        required=False,
+        default=10000,
+        type=int,
+        metavar='COUNT',
+        help='how many samples each loader worker shuffles at a time with --data-source shards, default: 10000',
+    )
+    parser.add_argument(
+        '--loader-workers',
+        required=False,
+        default=0,
+        type=int,
+        metavar='COUNT',
+        help='data loader worker processes per rank, 0 loads in the training process, default: 0',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        required=False,
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='where the memory-mapped MNIST cache is built and shared by local ranks, default: ./data/mnist-cache',
+    )
+    parser.add_argument(
+        '--fetch',
+        required=False,
+        default=None,
+        choices=['batch', 'sample'],
+        help='index whole batches out of the cache at once or collate them sample by sample, '
+             'default: batch for the cache, sample otherwise',
+    )
+    parser.add_argument(
+        '--checkpoint-dir',
+        required=False,
+        default='/valohai/outputs/checkpoints',
+        metavar='DIRECTORY',
+        help='where checkpoints are written and resumed from; every Valohai execution starts with an empty '
+             '/valohai/outputs, so to resume an earlier one point this at a directory holding its checkpoints, '
+             'e.g. a mounted shared volume, default: /valohai/outputs/checkpoints',
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        required=False,
+        default=100,
+        type=int,
+        metavar='STEPS',
+        help='how often to write a checkpoint in the background; 0 disables checkpointing, default: 100',
+    )
+    settings = parser.parse_args()
+    if settings.fetch is None:
+        settings.fetch = 'batch' if settings.data_source == 'cache' else 'sample'
+    if settings.fetch == 'batch' and settings.data_source != 'cache':
+        parser.error('--fetch batch requires --data-source cache')
+    if settings.compression == 'topk' and settings.all_reduce == 'hierarchical':
+        parser.error('--compression topk all-gathers across all ranks and cannot be hierarchical')
+    if settings.optimizer_state == 'sharded' and (settings.compression != 'none' or settings.all_reduce != 'flat'):
+        parser.error('--optimizer-state sharded reduce-scatters gradients itself, without compression or all-reduce')
+    if settings.local_steps < 1:
+        parser.error('--local-steps must be at least 1')
+    if settings.local_steps > 1 and settings.optimizer_state == 'sharded':
+        parser.error('--local-steps requires --optimizer-state replicated, a sharded optimizer has no local model')
+    if settings.compile == 'compile' and not hasattr(torch, 'compile'):
+        parser.error(f'--compile compile requires PyTorch 2.0 or newer, this is {torch.__version__}')
 
-    master_port = 1234
-    master_ip = valohai.distributed.master().primary_local_ip
-    url = f"tcp://{master_ip}:{master_port}"
-
-    size = valohai.distributed.required_count
-    rank = valohai.distributed.me().rank
-
-    mp.set_start_method('spawn')
-    p = mp.Process(target=init, args=(url, rank, size, run))
-    p.start()
-    p.join()
+    launch(functools.partial(run, settings=settings), backend='gloo', settings=settings)
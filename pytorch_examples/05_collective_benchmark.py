@@ -0,0 +1,226 @@
+"""
+Measure the latency and bandwidth of the collectives over a sweep of message sizes.
+
+Every operation runs on float32 tensors of each size; like nccl-tests, the size of `all_gather` is its whole
+gathered output, the size of `reduce_scatter` its whole input and the size of `send_recv` what every rank
+sends to the next one around the ring. Each call is timed separately after a barrier and the time of a call
+is that of its slowest rank. Bus bandwidth scales the algorithm bandwidth (bytes / median time) by the share
+of the data each rank has to move, so it can be compared to the link speed regardless of the world size.
+
+    python pytorch_examples/05_collective_benchmark.py --local --nproc 4 --max-bytes 64M
+"""
+
+import argparse
+import csv
+import functools
+import json
+import os
+import time
+
+import torch
+import torch.distributed as dist
+
+import cluster_config
+from collectives import reduce_scatter
+from launcher import add_launch_arguments, launch, launch_local
+
+OPERATIONS = ['all_reduce', 'broadcast', 'all_gather', 'reduce_scatter', 'send_recv']
+PERCENTILES = [50, 90, 99]
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Parse a byte count such as `4`, `64K` or `256M`."""
+    value = value.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in _UNITS else ''
+    return int(value[:len(value) - len(unit)]) * _UNITS[unit]
+
+
+def message_sizes(min_bytes, max_bytes, factor):
+    sizes = []
+    size = min_bytes
+    while size <= max_bytes:
+        sizes.append(size)
+        size *= factor
+    return sizes
+
+
+def bus_factor(operation, world_size):
+    if operation == 'all_reduce':
+        return 2 * (world_size - 1) / world_size
+    if operation in ['all_gather', 'reduce_scatter']:
+        return (world_size - 1) / world_size
+    return 1.0
+
+
+def prepare(operation, count, rank, world_size, device):
+    """
+    Allocate the buffers of `operation` on `count` float32 elements.
+
+    Returns a function running the operation once and a function telling whether the first run gave
+    the right result; the buffers are filled so that every rank's contribution can be told apart.
+    """
+    if operation == 'all_reduce':
+        tensor = torch.ones(count, device=device)
+        return functools.partial(dist.all_reduce, tensor), lambda: bool(torch.all(tensor == world_size))
+    if operation == 'broadcast':
+        tensor = torch.full((count,), float(rank), device=device)
+        return functools.partial(dist.broadcast, tensor, src=0), lambda: bool(torch.all(tensor == 0))
+    chunk = count // world_size
+    if operation == 'all_gather':
+        tensor = torch.full((chunk,), float(rank), device=device)
+        output = torch.empty(chunk * world_size, device=device)
+        outputs = list(output.split(chunk))
+        expected = torch.arange(world_size, device=device, dtype=output.dtype).repeat_interleave(chunk)
+        return functools.partial(dist.all_gather, outputs, tensor), lambda: bool(torch.all(output == expected))
+    if operation == 'reduce_scatter':
+        inputs = list(torch.ones(chunk * world_size, device=device).split(chunk))
+        output = torch.empty(chunk, device=device)
+        return functools.partial(reduce_scatter, output, inputs), lambda: bool(torch.all(output == world_size))
+    if operation == 'send_recv':
+        tensor = torch.full((count,), float(rank), device=device)
+        received = torch.empty(count, device=device)
+        source = (rank - 1) % world_size
+
+        def send_recv():
+            # posting both sides before waiting keeps a ring of blocking sends from deadlocking
+            works = [dist.isend(tensor, (rank + 1) % world_size), dist.irecv(received, source)]
+            for work in works:
+                work.wait()
+
+        return send_recv, lambda: bool(torch.all(received == source))
+    raise ValueError(f'unknown operation {operation}')
+
+
+def element_count(operation, size, world_size):
+    count = max(1, size // 4)
+    if operation in ['all_gather', 'reduce_scatter']:
+        # every rank gets an equal chunk of at least one element
+        count = max(1, count // world_size) * world_size
+    return count
+
+
+def measure(run, iterations, warmup, device):
+    synchronize = torch.cuda.synchronize if device.type == 'cuda' else lambda: None
+    for _ in range(warmup):
+        run()
+    synchronize()
+    times = torch.empty(iterations, dtype=torch.float64)
+    for iteration in range(iterations):
+        dist.barrier()
+        start = time.perf_counter()
+        run()
+        synchronize()
+        times[iteration] = time.perf_counter() - start
+    return times
+
+
+def benchmark(operation, size, rank, world_size, device, settings):
+    count = element_count(operation, size, world_size)
+    run, result_ok = prepare(operation, count, rank, world_size, device)
+    run()
+    correct = torch.tensor([int(result_ok())], device=device)
+    dist.all_reduce(correct, op=dist.ReduceOp.MIN)
+    if not correct.item():
+        raise RuntimeError(f'{operation} of {count * 4} bytes gave a wrong result')
+
+    times = measure(run, settings.iterations, settings.warmup, device).to(device)
+    dist.all_reduce(times, op=dist.ReduceOp.MAX)
+    times = times.cpu()
+    size = count * 4
+    algbw = size / times.median().item() / 1e9
+    row = {
+        'operation': operation,
+        'bytes': size,
+        'iterations': settings.iterations,
+        'min_us': times.min().item() * 1e6,
+        'mean_us': times.mean().item() * 1e6,
+    }
+    for percentile in PERCENTILES:
+        row[f'p{percentile}_us'] = torch.quantile(times, percentile / 100).item() * 1e6
+    row['algbw_gbps'] = algbw
+    row['busbw_gbps'] = algbw * bus_factor(operation, world_size)
+    return row
+
+
+def write_results(rows, metadata, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'collective_benchmark.json'), 'w') as fp:
+        json.dump(dict(metadata, results=rows), fp, indent=2)
+    with open(os.path.join(output_dir, 'collective_benchmark.csv'), 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run(my_rank, world_size, settings):
+    device = torch.device('cuda', torch.cuda.current_device()) if settings.backend == 'nccl' else torch.device('cpu')
+    operations = [op for op in settings.operations if op != 'send_recv' or world_size > 1]
+    rows = []
+    for operation in operations:
+        for size in message_sizes(settings.min_bytes, settings.max_bytes, settings.step_factor):
+            rows.append(benchmark(operation, size, my_rank, world_size, device, settings))
+            if my_rank == 0:
+                row = rows[-1]
+                print(f'{operation:>14} {row["bytes"]:>11} {row["p50_us"]:>11.1f} {row["p99_us"]:>11.1f} '
+                      f'{row["algbw_gbps"]:>8.3f} {row["busbw_gbps"]:>8.3f}', flush=True)
+
+    if my_rank == 0:
+        hosts = 1 if settings.local else cluster_config.load().required_count
+        metadata = {
+            'backend': settings.backend,
+            'world_size': world_size,
+            'hosts': hosts,
+            'torch_version': torch.__version__,
+            'reduce_scatter': 'per-chunk reduce' if settings.backend == 'gloo' else 'native',
+        }
+        write_results(rows, metadata, settings.output_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_launch_arguments(parser)
+    parser.add_argument(
+        '--local',
+        action='store_true',
+        help='run --nproc-per-node processes on this machine only, without a distributed configuration',
+    )
+    parser.add_argument('--backend', default='gloo', choices=['gloo', 'nccl'], help='default: gloo')
+    parser.add_argument(
+        '--operations',
+        default=OPERATIONS,
+        nargs='+',
+        choices=OPERATIONS,
+        metavar='OPERATION',
+        help=f'collectives to measure, send_recv needs at least two ranks, default: {" ".join(OPERATIONS)}',
+    )
+    parser.add_argument('--min-bytes', default=4, type=parse_size, metavar='SIZE', help='default: 4')
+    parser.add_argument('--max-bytes', default=256 * 1024 ** 2, type=parse_size, metavar='SIZE', help='default: 256M')
+    parser.add_argument(
+        '--step-factor',
+        default=2,
+        type=int,
+        metavar='FACTOR',
+        help='how much every message size is larger than the previous one, default: 2',
+    )
+    parser.add_argument('--iterations', default=20, type=int, metavar='COUNT', help='timed calls, default: 20')
+    parser.add_argument('--warmup', default=5, type=int, metavar='COUNT', help='untimed calls, default: 5')
+    parser.add_argument(
+        '--output-dir',
+        default='/valohai/outputs',
+        metavar='DIRECTORY',
+        help='where collective_benchmark.json and collective_benchmark.csv are written, default: /valohai/outputs',
+    )
+    settings = parser.parse_args()
+    if settings.min_bytes < 1 or settings.min_bytes > settings.max_bytes:
+        parser.error('--min-bytes must be between 1 and --max-bytes')
+    if settings.step_factor < 2:
+        parser.error('--step-factor must be at least 2')
+    if settings.iterations < 1:
+        parser.error('--iterations must be at least 1')
+
+    print(f'{"operation":>14} {"bytes":>11} {"p50 us":>11} {"p99 us":>11} {"algbw":>8} {"busbw":>8}')
+    if settings.local:
+        launch_local(run, settings.nproc_per_node, settings.master_port, backend=settings.backend, args=(settings,))
+    else:
+        launch(functools.partial(run, settings=settings), backend=settings.backend, settings=settings)
@@ -0,0 +1,72 @@
+"""
+Compare flat and hierarchical all-reduce on a simulated multi-host layout on this machine.
+
+Runs `--nproc` local gloo processes and pretends they are spread over `--hosts` hosts with consecutive
+ranks on the same host, the same layout `launcher.launch()` produces.
+
+    python pytorch_examples/benchmark_all_reduce.py --nproc 8 --hosts 2 --sizes 1024 1048576 16777216
+"""
+
+import argparse
+import time
+
+import torch
+import torch.distributed as dist
+
+from collectives import HierarchicalAllReduce, flat_all_reduce
+from launcher import launch_local
+
+
+def measure(all_reduce, tensor, iterations, warmup):
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            dist.barrier()
+            start = time.perf_counter()
+        all_reduce(tensor)
+    return (time.perf_counter() - start) / iterations
+
+
+def worker(rank, world_size, settings):
+    ranks_per_host = world_size // settings.hosts
+    hierarchical = HierarchicalAllReduce([f'host-{r // ranks_per_host}' for r in range(world_size)])
+
+    rows = []
+    for size in settings.sizes:
+        tensor = torch.ones(max(1, size // 4))
+        hierarchical(tensor)
+        if not torch.all(tensor == world_size):
+            raise RuntimeError(f'hierarchical all-reduce of {size} bytes gave a wrong result on rank {rank}')
+        times = torch.tensor([
+            measure(flat_all_reduce, tensor, settings.iterations, settings.warmup),
+            measure(hierarchical, tensor, settings.iterations, settings.warmup),
+        ], dtype=torch.float64)
+        dist.all_reduce(times, op=dist.ReduceOp.MAX)
+        rows.append((size, *times.tolist()))
+
+    if rank == 0:
+        print(f'{world_size} processes on {settings.hosts} simulated hosts, {settings.iterations} iterations')
+        print(f'{"bytes":>12} {"flat ms":>10} {"hier. ms":>10} {"speedup":>8}')
+        for size, flat, hier in rows:
+            print(f'{size:>12} {flat * 1000:>10.3f} {hier * 1000:>10.3f} {flat / hier:>7.2f}x')
+    dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nproc', default=8, type=int, metavar='COUNT', help='local processes, default: 8')
+    parser.add_argument('--hosts', default=2, type=int, metavar='COUNT', help='simulated hosts, default: 2')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='rendezvous port, default: 29500')
+    parser.add_argument('--iterations', default=20, type=int, metavar='COUNT', help='timed calls, default: 20')
+    parser.add_argument('--warmup', default=3, type=int, metavar='COUNT', help='untimed calls, default: 3')
+    parser.add_argument(
+        '--sizes',
+        default=[4096, 1024 * 1024, 16 * 1024 * 1024],
+        nargs='+',
+        type=int,
+        metavar='BYTES',
+        help='message sizes to compare, default: 4096 1048576 16777216',
+    )
+    settings = parser.parse_args()
+    if settings.nproc % settings.hosts:
+        parser.error('--nproc must be divisible by --hosts')
+    launch_local(worker, settings.nproc, settings.port, args=(settings,))
@@ -0,0 +1,116 @@
+"""
+Compare bytes sent per step and convergence of the gradient compression modes of `04_gloo_mnist.py`.
+
+Trains the same model from the same seed for `--steps` steps with every mode on `--nproc` local gloo
+processes, and fails if a mode's final loss is more than `--tolerance` above the uncompressed baseline.
+
+    python pytorch_examples/benchmark_compression.py --nproc 4 --steps 300
+"""
+
+import argparse
+import sys
+
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torch import optim
+from torch.utils.data import BatchSampler
+
+from compression import build_compression
+from gradient_sync import GradientBucketer
+from launcher import launch_local
+from mnist_cache import cached_mnist
+from models import Net
+from partitioning import DistributedEpochSampler
+
+
+def train(dataset, mode, settings):
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    torch.manual_seed(1234)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    compression = build_compression(mode, topk_ratio=settings.topk_ratio)
+    bucketer = GradientBucketer(model.parameters(), compression=compression)
+    sampler = DistributedEpochSampler(dataset, num_replicas=world_size, rank=rank)
+    batches = BatchSampler(sampler, batch_size=int(128 / float(world_size)), drop_last=True)
+
+    losses = []
+    epoch = 0
+    while len(losses) < settings.steps:
+        sampler.set_epoch(epoch)
+        for indexes in batches:
+            data, target = dataset[indexes]
+            optimizer.zero_grad()
+            loss = F.nll_loss(model(data), target)
+            loss.backward()
+            bucketer.synchronize()
+            optimizer.step()
+            losses.append(loss.item())
+            if len(losses) == settings.steps:
+                break
+        epoch += 1
+    bucketer.remove()
+
+    # the mean loss of the last steps over all ranks, and how much a rank sent per step
+    result = torch.tensor([sum(losses[-settings.window:]) / settings.window, compression.bytes_sent / settings.steps])
+    dist.all_reduce(result)
+    return (result / world_size).tolist()
+
+
+def worker(rank, world_size, settings):
+    dataset = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=True)
+
+    results = [(mode, *train(dataset, mode, settings)) for mode in settings.modes]
+    if rank == 0:
+        baseline_loss, baseline_bytes = results[0][1:]
+        print(f'{world_size} processes, {settings.steps} steps, loss over the last {settings.window} steps')
+        print(f'{"mode":>6} {"loss":>8} {"MB/step":>9} {"ratio":>7}')
+        failed = []
+        for mode, loss, sent in results:
+            converged = loss <= baseline_loss * (1 + settings.tolerance)
+            if not converged:
+                failed.append(mode)
+            print(
+                f'{mode:>6} {loss:>8.4f} {sent / 1024 / 1024:>9.3f} {baseline_bytes / sent:>6.1f}x'
+                f'  {"ok" if converged else "DID NOT CONVERGE"}'
+            )
+        if failed:
+            sys.exit(1)
+    dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default='./data', metavar='DIRECTORY', help='MNIST location, default: ./data')
+    parser.add_argument(
+        '--cache-dir',
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='memory-mapped cache location, default: ./data/mnist-cache',
+    )
+    parser.add_argument('--nproc', default=4, type=int, metavar='COUNT', help='local processes, default: 4')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='rendezvous port, default: 29500')
+    parser.add_argument('--steps', default=300, type=int, metavar='COUNT', help='training steps, default: 300')
+    parser.add_argument('--window', default=50, type=int, metavar='COUNT', help='steps averaged, default: 50')
+    parser.add_argument('--topk-ratio', default=0.01, type=float, metavar='RATIO', help='default: 0.01')
+    parser.add_argument(
+        '--tolerance',
+        default=0.1,
+        type=float,
+        metavar='FRACTION',
+        help='how much higher than the baseline a final loss may be, default: 0.1',
+    )
+    parser.add_argument(
+        '--modes',
+        default=['none', 'fp16', 'topk'],
+        nargs='+',
+        choices=['none', 'fp16', 'topk'],
+        help='compression modes to compare, the first is the baseline, default: none fp16 topk',
+    )
+    settings = parser.parse_args()
+    if settings.window > settings.steps:
+        parser.error('--window cannot be larger than --steps')
+    # build the cache once up front instead of racing to download MNIST from every process
+    cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=True)
+    launch_local(worker, settings.nproc, settings.port, args=(settings,))
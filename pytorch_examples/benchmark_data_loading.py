@@ -0,0 +1,74 @@
+"""
+Compare samples/sec of the MNIST loading paths used by `04_gloo_mnist.py` over one epoch of one rank.
+
+    python pytorch_examples/benchmark_data_loading.py --world-size 4
+"""
+
+import argparse
+import time
+
+from torch.utils.data import BatchSampler, DataLoader
+from torchvision import datasets, transforms
+
+from mnist_cache import MNIST_MEAN, MNIST_STD, cached_mnist
+from partitioning import DistributedEpochSampler
+
+
+def measure(loader, epochs):
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for data, _ in loader:
+            samples += len(data)
+    return samples / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default='./data', metavar='DIRECTORY', help='MNIST location, default: ./data')
+    parser.add_argument(
+        '--cache-dir',
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='memory-mapped cache location, default: ./data/mnist-cache',
+    )
+    parser.add_argument(
+        '--world-size',
+        default=1,
+        type=int,
+        metavar='COUNT',
+        help='simulated number of ranks; sets the shard and batch size like the trainer, default: 1',
+    )
+    parser.add_argument('--epochs', default=1, type=int, metavar='COUNT', help='epochs per path, default: 1')
+    settings = parser.parse_args()
+
+    bsz = int(128 / float(settings.world_size))
+    transformed = datasets.MNIST(
+        root=settings.root,
+        train=True,
+        download=True,
+        transform=transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize((MNIST_MEAN,), (MNIST_STD,))
+        ]),
+    )
+    cached = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=True)
+
+    def sampler_for(dataset):
+        return DistributedEpochSampler(dataset, num_replicas=settings.world_size, rank=0)
+
+    loaders = [
+        ('torchvision, per sample', DataLoader(transformed, batch_size=bsz, sampler=sampler_for(transformed))),
+        ('cache, per sample', DataLoader(cached, batch_size=bsz, sampler=sampler_for(cached))),
+        ('cache, batch fetch', DataLoader(
+            cached,
+            batch_size=None,
+            sampler=BatchSampler(sampler_for(cached), batch_size=bsz, drop_last=False),
+        )),
+    ]
+    print(f'batch size {bsz}, {len(sampler_for(cached))} samples per epoch')
+    baseline = None
+    for name, loader in loaders:
+        rate = measure(loader, settings.epochs)
+        baseline = baseline or rate
+        print(f'{name:>24}: {rate:12.0f} samples/s  {rate / baseline:6.1f}x')
@@ -0,0 +1,89 @@
+"""
+Check that evaluating with the test set split across ranks gives the metrics of a single process, and time it.
+
+Evaluates one seeded `04_gloo_mnist.py` model on the cached MNIST test set in this process, then again
+with every `--nproc` count of local gloo processes, each taking its strided share of the set. The sample
+count and the confusion matrix must match exactly; the mean loss may only differ by the order in which
+the float64 sums were added up.
+
+    python pytorch_examples/benchmark_evaluation.py --nproc 1 3 7
+"""
+
+import argparse
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import BatchSampler, DataLoader, SequentialSampler
+
+from evaluation import evaluate, local_metrics, summarize
+from launcher import launch_local
+from mnist_cache import cached_mnist
+from models import Net
+from partitioning import StridedSampler
+
+
+def build_model():
+    torch.manual_seed(1234)
+    return Net()
+
+
+def loader(dataset, sampler, batch_size):
+    return DataLoader(dataset, batch_size=None, sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False))
+
+
+def worker(rank, world_size, settings, results):
+    dataset = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=False)
+    sampler = StridedSampler(dataset, num_replicas=world_size, rank=rank)
+    model = build_model()
+    dist.barrier()
+    start = time.perf_counter()
+    metrics = evaluate(model, loader(dataset, sampler, settings.batch_size))
+    seconds = torch.tensor([time.perf_counter() - start])
+    dist.all_reduce(seconds, op=dist.ReduceOp.MAX)
+    if rank == 0:
+        # plain lists, a tensor would be shared through a file descriptor that dies with this process
+        results.put((metrics['loss'], metrics['count'], metrics['confusion'].tolist(), seconds.item()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--nproc',
+        default=[1, 3, 7],
+        nargs='+',
+        type=int,
+        metavar='COUNT',
+        help='process counts to compare with a single process, default: 1 3 7',
+    )
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='first port to use, default: 29500')
+    parser.add_argument('--root', default='./data', metavar='DIRECTORY', help='MNIST location, default: ./data')
+    parser.add_argument(
+        '--cache-dir',
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='memory-mapped cache location, default: ./data/mnist-cache',
+    )
+    parser.add_argument('--batch-size', default=1000, type=int, metavar='COUNT', help='per process, default: 1000')
+    settings = parser.parse_args()
+
+    dataset = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=False)
+    start = time.perf_counter()
+    expected = summarize(local_metrics(build_model(), loader(dataset, SequentialSampler(dataset), settings.batch_size)))
+    print(f'single process: {expected["count"]} samples, loss {expected["loss"]:.6f}, '
+          f'accuracy {expected["accuracy"]:.4f}, {time.perf_counter() - start:.2f} s')
+
+    print(f'{"processes":>9} {"samples":>8} {"seconds":>8} {"confusion":>10} {"loss difference":>16}')
+    mismatches = 0
+    context = mp.get_context('spawn')
+    for offset, nproc in enumerate(settings.nproc):
+        results = context.SimpleQueue()
+        launch_local(worker, nproc, settings.port + offset, args=(settings, results))
+        loss, count, confusion, seconds = results.get()
+        same = count == expected['count'] and confusion == expected['confusion'].tolist()
+        mismatches += not same
+        print(f'{nproc:>9} {count:>8} {seconds:>8.2f} {"exact" if same else "MISMATCH":>10} '
+              f'{abs(loss - expected["loss"]):>16.3g}')
+    if mismatches:
+        exit(1)
@@ -0,0 +1,86 @@
+"""
+Compare training step time of per-parameter and bucketed gradient averaging.
+
+Runs `--nproc` local processes in a single gloo group on this machine with random MNIST-shaped data,
+so it doesn't need a Valohai distributed task or the MNIST dataset.
+
+    python pytorch_examples/benchmark_gradient_sync.py --nproc 4 --bucket-size-mb 0.25 1 4 25
+"""
+
+import argparse
+import time
+
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torch import optim
+
+from gradient_sync import GradientBucketer, average_gradients
+from launcher import launch_local
+from models import Net
+
+
+def measure(model, optimizer, data, target, sync, steps, warmup):
+    for step in range(warmup + steps):
+        if step == warmup:
+            dist.barrier()
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        loss = F.nll_loss(model(data), target)
+        loss.backward()
+        sync()
+        optimizer.step()
+    return (time.perf_counter() - start) / steps
+
+
+def worker(rank, world_size, settings):
+    torch.manual_seed(1234)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    data = torch.randn(settings.batch_size, 1, 28, 28)
+    target = torch.randint(0, 10, (settings.batch_size,))
+
+    results = [('per-parameter', measure(
+        model, optimizer, data, target,
+        sync=lambda: average_gradients(model),
+        steps=settings.steps,
+        warmup=settings.warmup,
+    ))]
+    for bucket_size_mb in settings.bucket_size_mb:
+        bucketer = GradientBucketer(model.parameters(), bucket_size_mb=bucket_size_mb)
+        results.append((f'bucketed {bucket_size_mb} MB ({len(bucketer.buckets)} buckets)', measure(
+            model, optimizer, data, target,
+            sync=bucketer.synchronize,
+            steps=settings.steps,
+            warmup=settings.warmup,
+        )))
+        bucketer.remove()
+
+    # report the slowest rank as that is what the whole group waits for
+    times = torch.tensor([seconds for _, seconds in results], dtype=torch.float64)
+    dist.all_reduce(times, op=dist.ReduceOp.MAX)
+    if rank == 0:
+        baseline = times[0].item()
+        print(f'{world_size} processes, batch size {settings.batch_size}, {settings.steps} steps')
+        for (name, _), seconds in zip(results, times.tolist()):
+            print(f'{name:>36}: {seconds * 1000:8.2f} ms/step  {baseline / seconds:5.2f}x')
+    dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nproc', default=4, type=int, metavar='COUNT', help='local processes, default: 4')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='rendezvous port, default: 29500')
+    parser.add_argument('--batch-size', default=32, type=int, metavar='SIZE', help='per-rank batch, default: 32')
+    parser.add_argument('--steps', default=30, type=int, metavar='COUNT', help='timed steps, default: 30')
+    parser.add_argument('--warmup', default=5, type=int, metavar='COUNT', help='untimed steps, default: 5')
+    parser.add_argument(
+        '--bucket-size-mb',
+        default=[1.0, 25.0],
+        nargs='+',
+        type=float,
+        metavar='MEGABYTES',
+        help='bucket sizes to compare, default: 1 25',
+    )
+    settings = parser.parse_args()
+    launch_local(worker, settings.nproc, settings.port, args=(settings,))
@@ -0,0 +1,126 @@
+"""
+Compare the wall-clock time to reach a target training loss with local SGD and with per-step gradient averaging.
+
+Runs `--nproc` local processes in a single gloo group on this machine, each training the `04_gloo_mnist.py`
+model on its own random batches of the cached MNIST training set, once for every `--local-steps` value;
+1 is the synchronous baseline that averages gradients in buckets on every step. Every `--check-every` steps
+the mean training loss since the previous check is averaged across ranks, and a run ends once that reaches
+`--target-loss`. `--delay-ms` sleeps before every all-reduce to stand in for a slower link between hosts.
+
+    python pytorch_examples/benchmark_local_sgd.py --nproc 4 --local-steps 1 4 16 --delay-ms 20
+"""
+
+import argparse
+import time
+
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torch import optim
+
+from collectives import flat_all_reduce
+from gradient_sync import GradientBucketer, average_gradients
+from launcher import launch_local
+from local_sgd import PeriodicAverager
+from mnist_cache import cached_mnist
+from models import Net
+
+
+def train(dataset, local_steps, rank, settings):
+    def all_reduce(tensor, async_op=False):
+        time.sleep(settings.delay_ms / 1000)
+        return flat_all_reduce(tensor, async_op=async_op)
+
+    torch.manual_seed(1234)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    bucketer = None
+    averager = None
+    if local_steps == 1:
+        bucketer = GradientBucketer(model.parameters(), all_reduce=all_reduce)
+    else:
+        averager = PeriodicAverager(
+            model,
+            optimizer,
+            period=local_steps,
+            warmup_steps=settings.warmup,
+            average_momentum=settings.average_momentum,
+            all_reduce=all_reduce,
+        )
+
+    # the same batches on a rank for every run
+    generator = torch.Generator().manual_seed(rank)
+    dist.barrier()
+    start = time.perf_counter()
+    window_loss = 0.0
+    loss = float('inf')
+    for step in range(1, settings.max_steps + 1):
+        data, target = dataset[torch.randint(len(dataset), (settings.batch_size,), generator=generator)]
+        optimizer.zero_grad()
+        batch_loss = F.nll_loss(model(data), target)
+        batch_loss.backward()
+        if bucketer:
+            bucketer.synchronize()
+        elif averager.synchronizes(step):
+            average_gradients(model, all_reduce=all_reduce)
+        optimizer.step()
+        if averager:
+            averager.step(step)
+        window_loss += batch_loss.item()
+        if step % settings.check_every == 0:
+            mean_loss = torch.tensor([window_loss / settings.check_every])
+            dist.all_reduce(mean_loss)
+            loss = mean_loss.item() / dist.get_world_size()
+            window_loss = 0.0
+            if loss <= settings.target_loss:
+                break
+    seconds = time.perf_counter() - start
+    if bucketer:
+        bucketer.remove()
+    return step, seconds, loss
+
+
+def worker(rank, world_size, settings):
+    dataset = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=True)
+    results = [(local_steps, *train(dataset, local_steps, rank, settings)) for local_steps in settings.local_steps]
+
+    if rank == 0:
+        print(f'{world_size} processes, batch size {settings.batch_size}, target loss {settings.target_loss}, '
+              f'{settings.delay_ms} ms delay per all-reduce')
+        print(f'{"local steps":>11} {"steps":>6} {"seconds":>8} {"loss":>7} {"speedup":>8}')
+        baseline = results[0][2]
+        for local_steps, steps, seconds, loss in results:
+            reached = '' if loss <= settings.target_loss else '  target not reached'
+            print(f'{local_steps:>11} {steps:>6} {seconds:>8.1f} {loss:>7.4f} {baseline / seconds:>7.2f}x{reached}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nproc', default=4, type=int, metavar='COUNT', help='local processes, default: 4')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='rendezvous port, default: 29500')
+    parser.add_argument('--root', default='./data', metavar='DIRECTORY', help='MNIST location, default: ./data')
+    parser.add_argument(
+        '--cache-dir',
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='memory-mapped cache location, default: ./data/mnist-cache',
+    )
+    parser.add_argument(
+        '--local-steps',
+        default=[1, 4, 16],
+        nargs='+',
+        type=int,
+        metavar='STEPS',
+        help='steps between model averages to compare, the first is the baseline, default: 1 4 16',
+    )
+    parser.add_argument('--warmup', default=0, type=int, metavar='STEPS', help='synchronous steps, default: 0')
+    parser.add_argument('--average-momentum', action='store_true', help='average momentum buffers too')
+    parser.add_argument('--target-loss', default=0.5, type=float, metavar='LOSS', help='default: 0.5')
+    parser.add_argument('--check-every', default=16, type=int, metavar='STEPS', help='default: 16')
+    parser.add_argument('--max-steps', default=2000, type=int, metavar='COUNT', help='default: 2000')
+    parser.add_argument('--batch-size', default=32, type=int, metavar='COUNT', help='per process, default: 32')
+    parser.add_argument('--delay-ms', default=0.0, type=float, metavar='MILLISECONDS', help='default: 0')
+    settings = parser.parse_args()
+    if min(settings.local_steps) < 1:
+        parser.error('--local-steps must be at least 1')
+    launch_local(worker, settings.nproc, settings.port, args=(settings,))
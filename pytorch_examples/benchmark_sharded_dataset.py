@@ -0,0 +1,90 @@
+"""
+Check that streaming a sharded dataset takes the same memory however large the dataset is, and measure its speed.
+
+Writes a dataset of random MNIST-shaped records for every `--records` count under `--directory`, then reads
+one epoch of each in a fresh process with `StreamingShardDataset` and `--loader-workers` loader workers,
+reporting records per second and how much the peak resident memory of the reading process grew.
+
+    python pytorch_examples/benchmark_sharded_dataset.py --records 100000 1000000 --directory /tmp/shards
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from shard_format import ShardWriter, read_index
+from sharded_dataset import MNIST_FIELDS, StreamingShardDataset
+
+
+def write_random(directory, records, shard_size_mb, chunk_size=8192):
+    rng = np.random.default_rng(1234)
+    with ShardWriter(directory, MNIST_FIELDS, shard_size_mb=shard_size_mb) as writer:
+        for start in range(0, records, chunk_size):
+            count = min(chunk_size, records - start)
+            writer.write(
+                image=rng.integers(0, 256, size=(count, 28, 28), dtype=np.uint8),
+                label=rng.integers(0, 10, size=count),
+            )
+
+
+def peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stream(directory, settings, results):
+    dataset = StreamingShardDataset(
+        directory,
+        batch_size=settings.batch_size,
+        num_workers=settings.loader_workers,
+        shuffle_buffer=settings.shuffle_buffer,
+    )
+    loader = DataLoader(dataset, batch_size=None, num_workers=settings.loader_workers)
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    records = sum(len(labels) for _, labels in loader)
+    results.put((records, time.perf_counter() - start, peak_rss_mb() - before))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--records',
+        default=[100000, 1000000],
+        nargs='+',
+        type=int,
+        metavar='COUNT',
+        help='dataset sizes to compare, default: 100000 1000000',
+    )
+    parser.add_argument(
+        '--directory',
+        default='./data/benchmark-shards',
+        metavar='DIRECTORY',
+        help='where the datasets are written and removed afterwards, default: ./data/benchmark-shards',
+    )
+    parser.add_argument('--shard-size-mb', default=64, type=float, metavar='MEGABYTES', help='default: 64')
+    parser.add_argument('--batch-size', default=64, type=int, metavar='COUNT', help='default: 64')
+    parser.add_argument('--shuffle-buffer', default=10000, type=int, metavar='COUNT', help='default: 10000')
+    parser.add_argument('--loader-workers', default=0, type=int, metavar='COUNT', help='default: 0')
+    settings = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f'{"records":>10} {"dataset MB":>11} {"shards":>7} {"records/s":>10} {"peak RSS growth MB":>19}')
+    for count in settings.records:
+        directory = os.path.join(settings.directory, str(count))
+        write_random(directory, count, settings.shard_size_mb)
+        index = read_index(directory)
+        size_mb = count * index['record_bytes'] / 1024 / 1024
+        results = context.Queue()
+        process = context.Process(target=stream, args=(directory, settings, results))
+        process.start()
+        records, seconds, growth = results.get()
+        process.join()
+        shutil.rmtree(directory)
+        print(f'{records:>10} {size_mb:>11.1f} {len(index["shards"]):>7} {records / seconds:>10.0f} {growth:>19.1f}')
@@ -0,0 +1,94 @@
+"""
+Check that the sharded optimizer trains to the same weights as the replicated one and compare their cost.
+
+Runs `--nproc` local processes in a single gloo group on this machine with random MNIST-shaped data, trains
+the same model from the same seed on the same batches both ways and fails if any final weight differs by
+more than `--tolerance`.
+
+    python pytorch_examples/benchmark_sharded_optimizer.py --nproc 4 --steps 50
+"""
+
+import argparse
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torch import optim
+
+from gradient_sync import average_gradients
+from launcher import launch_local
+from models import Net
+from sharded_optimizer import ShardedOptimizer, optimizer_state_bytes
+
+
+def train(sharded, rank, settings):
+    torch.manual_seed(1234)
+    model = Net()
+    if sharded:
+        optimizer = ShardedOptimizer(model.parameters(), optim.SGD, lr=0.01, momentum=0.5)
+    else:
+        optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    # every rank trains on its own batches, the same ones in both modes
+    generator = torch.Generator().manual_seed(rank)
+    for step in range(settings.warmup + settings.steps):
+        if step == settings.warmup:
+            dist.barrier()
+            start = time.perf_counter()
+        data = torch.randn(settings.batch_size, 1, 28, 28, generator=generator)
+        target = torch.randint(0, 10, (settings.batch_size,), generator=generator)
+        optimizer.zero_grad()
+        loss = F.nll_loss(model(data), target)
+        loss.backward()
+        if not sharded:
+            average_gradients(model)
+        optimizer.step()
+    seconds = (time.perf_counter() - start) / settings.steps
+    state_bytes = optimizer_state_bytes(optimizer.optimizer if sharded else optimizer)
+    weights = torch.cat([p.detach().view(-1) for p in model.parameters()])
+    return weights, seconds, state_bytes
+
+
+def worker(rank, world_size, settings):
+    replicated_weights, replicated_seconds, replicated_bytes = train(False, rank, settings)
+    sharded_weights, sharded_seconds, sharded_bytes = train(True, rank, settings)
+
+    results = torch.tensor([
+        (sharded_weights - replicated_weights).abs().max().item(),
+        replicated_seconds,
+        sharded_seconds,
+        replicated_bytes,
+        sharded_bytes,
+    ], dtype=torch.float64)
+    # report the worst rank as that is what the whole group waits for and has to fit into memory
+    dist.all_reduce(results, op=dist.ReduceOp.MAX)
+    difference, replicated_seconds, sharded_seconds, replicated_bytes, sharded_bytes = results.tolist()
+    if rank == 0:
+        print(f'{world_size} processes, batch size {settings.batch_size}, {settings.steps} steps')
+        print(f'  replicated: {replicated_seconds * 1000:8.2f} ms/step, '
+              f'optimizer state {replicated_bytes / 1024:9.1f} KB per rank')
+        print(f'     sharded: {sharded_seconds * 1000:8.2f} ms/step, '
+              f'optimizer state {sharded_bytes / 1024:9.1f} KB per rank '
+              f'({replicated_bytes / max(1.0, sharded_bytes):.2f}x less)')
+        print(f'  largest weight difference: {difference:.3g}')
+    if difference > settings.tolerance:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nproc', default=4, type=int, metavar='COUNT', help='local processes, default: 4')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='rendezvous port, default: 29500')
+    parser.add_argument('--steps', default=50, type=int, metavar='COUNT', help='timed training steps, default: 50')
+    parser.add_argument('--warmup', default=5, type=int, metavar='COUNT', help='untimed steps, default: 5')
+    parser.add_argument('--batch-size', default=32, type=int, metavar='COUNT', help='per process, default: 32')
+    parser.add_argument(
+        '--tolerance',
+        default=1e-5,
+        type=float,
+        metavar='DIFFERENCE',
+        help='the largest allowed difference of a final weight between the two modes, default: 1e-5',
+    )
+    settings = parser.parse_args()
+    launch_local(worker, settings.nproc, settings.port, args=(settings,))
@@ -0,0 +1,117 @@
+"""
+Measure the time from launching workers to their first collective for each start method and rendezvous.
+
+For every combination of `--start-methods` and `--rendezvous`, launches `--nproc` local gloo workers
+`--repeats` times, each time from a new Python process, the way a job starts. `url` initializes the process
+group with `init_method='tcp://...'`; `store` goes through `launcher.rendezvous()` and a `TCPStore` served by
+the launching process. Reports the median time, counted from the launch, until the last worker started
+running its own code and until the last one finished its first all-reduce.
+
+    python pytorch_examples/benchmark_startup.py --nproc 4 --repeats 3
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+
+from launcher import rendezvous, worker_context
+
+
+def worker(rank, world_size, method, port, results):
+    started = time.time()
+    if method == 'url':
+        dist.init_process_group(
+            init_method=f'tcp://127.0.0.1:{port}',
+            rank=rank,
+            world_size=world_size,
+            backend='gloo',
+        )
+    else:
+        rendezvous(rank, world_size, 'gloo', '127.0.0.1', port, timeout=60)
+    dist.all_reduce(torch.ones(1))
+    results.put((started, time.time()))
+
+
+def trial(start_method, method, nproc, port):
+    """Launch the workers once and print when the last one started and finished its first all-reduce."""
+    store = None
+    if method == 'store':
+        store = dist.TCPStore(
+            '127.0.0.1',
+            port,
+            is_master=True,
+            wait_for_workers=False,
+            timeout=datetime.timedelta(seconds=60),
+        )
+    context = worker_context(start_method)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(rank, nproc, method, port, results)) for rank in range(nproc)]
+    for p in processes:
+        p.start()
+    times = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    del store
+    print(json.dumps([max(started for started, _ in times), max(finished for _, finished in times)]))
+
+
+def launch(start_method, method, nproc, port):
+    launched = time.time()
+    command = [sys.executable, os.path.abspath(__file__), '--trial', start_method, method]
+    output = subprocess.run(
+        [*command, '--nproc', str(nproc), '--port', str(port)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    started, finished = json.loads(output.splitlines()[-1])
+    return started - launched, finished - launched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nproc', default=4, type=int, metavar='COUNT', help='local processes, default: 4')
+    parser.add_argument('--port', default=29500, type=int, metavar='PORT', help='first port to use, default: 29500')
+    parser.add_argument(
+        '--start-methods',
+        default=['spawn', 'forkserver'],
+        nargs='+',
+        choices=['spawn', 'forkserver'],
+        help='default: spawn forkserver',
+    )
+    parser.add_argument(
+        '--rendezvous',
+        default=['url', 'store'],
+        nargs='+',
+        choices=['url', 'store'],
+        help='default: url store',
+    )
+    parser.add_argument('--repeats', default=3, type=int, metavar='COUNT', help='launches of each, default: 3')
+    parser.add_argument('--trial', nargs=2, help=argparse.SUPPRESS)
+    settings = parser.parse_args()
+
+    if settings.trial:
+        trial(*settings.trial, settings.nproc, settings.port)
+        exit()
+
+    print(f'{settings.nproc} processes, median of {settings.repeats} launches')
+    print(f'{"start method":>12} {"rendezvous":>10} {"workers up s":>13} {"first collective s":>19}')
+    port = settings.port
+    for start_method in settings.start_methods:
+        for method in settings.rendezvous:
+            runs = []
+            for _ in range(settings.repeats):
+                runs.append(launch(start_method, method, settings.nproc, port))
+                # a fresh port every time, the previous one may linger in TIME_WAIT
+                port += 1
+            started = statistics.median(started for started, _ in runs)
+            finished = statistics.median(finished for _, finished in runs)
+            print(f'{start_method:>12} {method:>10} {started:>13.2f} {finished:>19.2f}')
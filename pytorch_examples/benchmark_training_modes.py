@@ -0,0 +1,117 @@
+"""
+Compare samples/sec and accuracy of the precision and compilation modes of `04_gloo_mnist.py` on the CPU.
+
+Trains the same model from the same seed on the same batches for `--steps` steps with every mode in one
+process, and fails if a mode's loss on a fixed batch before training differs from the first mode's by more
+than `--forward-tolerance`, or if its final loss is more than `--tolerance` above the first mode's.
+Modes are written as `PRECISION+COMPILE`, e.g. `bf16+script`; `+none` can be left out.
+
+    python pytorch_examples/benchmark_training_modes.py --modes fp32 bf16 fp32+script fp32+compile bf16+compile
+"""
+
+import argparse
+import sys
+import time
+
+import torch
+from torch import optim
+
+from mnist_cache import cached_mnist
+from models import Net
+from training_modes import autocast, build_loss_fn
+
+
+def train(dataset, precision, compile_mode, settings):
+    torch.manual_seed(1234)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    loss_fn = build_loss_fn(model, compile_mode)
+
+    # the loss on a fixed batch without dropout tells apart numeric differences from training noise
+    data, target = dataset[list(range(settings.batch_size))]
+    loss_fn.eval()
+    with torch.no_grad(), autocast(precision):
+        initial_loss = loss_fn(data, target).item()
+    loss_fn.train()
+
+    generator = torch.Generator().manual_seed(1234)
+    losses = []
+    for step in range(settings.warmup + settings.steps):
+        if step == settings.warmup:
+            start = time.perf_counter()
+        data, target = dataset[torch.randint(len(dataset), (settings.batch_size,), generator=generator)]
+        optimizer.zero_grad()
+        with autocast(precision):
+            loss = loss_fn(data, target)
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+    samples_per_second = settings.steps * settings.batch_size / (time.perf_counter() - start)
+    return initial_loss, sum(losses[-settings.window:]) / settings.window, samples_per_second
+
+
+def parse_mode(mode):
+    precision, _, compile_mode = mode.partition('+')
+    return precision, compile_mode or 'none'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default='./data', metavar='DIRECTORY', help='MNIST location, default: ./data')
+    parser.add_argument(
+        '--cache-dir',
+        default='./data/mnist-cache',
+        metavar='DIRECTORY',
+        help='memory-mapped cache location, default: ./data/mnist-cache',
+    )
+    parser.add_argument('--steps', default=200, type=int, metavar='COUNT', help='timed training steps, default: 200')
+    parser.add_argument('--warmup', default=10, type=int, metavar='COUNT', help='untimed steps, default: 10')
+    parser.add_argument('--window', default=50, type=int, metavar='COUNT', help='steps averaged, default: 50')
+    parser.add_argument('--batch-size', default=128, type=int, metavar='COUNT', help='default: 128')
+    parser.add_argument(
+        '--forward-tolerance',
+        default=0.02,
+        type=float,
+        metavar='FRACTION',
+        help='how much the loss on a fixed batch may differ from the baseline before training, default: 0.02',
+    )
+    parser.add_argument(
+        '--tolerance',
+        default=0.1,
+        type=float,
+        metavar='FRACTION',
+        help='how much higher than the baseline a final loss may be, default: 0.1',
+    )
+    parser.add_argument(
+        '--modes',
+        default=['fp32', 'bf16', 'fp32+script'],
+        nargs='+',
+        metavar='MODE',
+        help='modes to compare, the first is the baseline, default: fp32 bf16 fp32+script',
+    )
+    settings = parser.parse_args()
+    if settings.window > settings.warmup + settings.steps:
+        parser.error('--window cannot be larger than --warmup plus --steps')
+    modes = [parse_mode(mode) for mode in settings.modes]
+    for precision, compile_mode in modes:
+        if precision not in ['fp32', 'bf16'] or compile_mode not in ['none', 'script', 'compile']:
+            parser.error(f'unknown mode {precision}+{compile_mode}')
+        if compile_mode == 'compile' and not hasattr(torch, 'compile'):
+            parser.error(f'+compile modes require PyTorch 2.0 or newer, this is {torch.__version__}')
+
+    dataset = cached_mnist(root=settings.root, cache_dir=settings.cache_dir, train=True)
+    results = [(mode, *train(dataset, *parse_mode(mode), settings)) for mode in settings.modes]
+
+    baseline_initial, baseline_loss, baseline_speed = results[0][1:]
+    print(f'{settings.steps} steps of {settings.batch_size} samples, loss over the last {settings.window} steps')
+    print(f'{"mode":>13} {"initial":>8} {"loss":>8} {"samples/s":>10} {"speedup":>8}')
+    failed = []
+    for mode, initial, loss, speed in results:
+        close = abs(initial - baseline_initial) <= baseline_initial * settings.forward_tolerance
+        converged = loss <= baseline_loss * (1 + settings.tolerance)
+        if not (close and converged):
+            failed.append(mode)
+        status = 'ok' if close and converged else 'LOSS DIFFERS' if not close else 'DID NOT CONVERGE'
+        print(f'{mode:>13} {initial:>8.4f} {loss:>8.4f} {speed:>10.0f} {speed / baseline_speed:>7.2f}x  {status}')
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+
+import torch
+import torch.distributed as dist
+
+_STEP_DIRECTORY = re.compile(r'^step-(\d+)$')
+
+
+def snapshot(state):
+    """Copy every tensor in a nested state dict to CPU memory so training can keep updating the originals."""
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+
+def _save(obj, path):
+    torch.save(obj, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+
+
+class AsyncCheckpointer:
+    """
+    Write checkpoints in a background thread while training continues.
+
+    Each checkpoint is a `step-NNNNNNNNN` directory: rank 0 writes the state replicated on every rank
+    (model, optimizer, progress) to `replicated.pt`, and every rank writes its own state to `rank-N.pt`
+    followed by an empty `rank-N.done` marker. A checkpoint is complete when all of those exist.
+    Only one write is in flight per rank; saving again first waits for the previous one.
+    Ranks keep their part of the latest `keep` checkpoints and remove the rest.
+    """
+
+    def __init__(self, directory, rank, keep=3):
+        self.directory = directory
+        self.rank = rank
+        self.keep = keep
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, step, replicated_state, local_state):
+        replicated = snapshot(replicated_state) if self.rank == 0 else None
+        local = snapshot(local_state)
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(step, replicated, local), daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, step, replicated, local):
+        path = os.path.join(self.directory, f'step-{step:09d}')
+        os.makedirs(path, exist_ok=True)
+        if replicated is not None:
+            _save(replicated, os.path.join(path, 'replicated.pt'))
+        _save(local, os.path.join(path, f'rank-{self.rank}.pt'))
+        open(os.path.join(path, f'rank-{self.rank}.done'), mode='w').close()
+        self._prune()
+
+    def _prune(self):
+        # each rank only removes its own files, so the directory may be shared or local to each host;
+        # a lagging rank can be at most one write behind, which keeping three checkpoints tolerates
+        steps = complete_steps(self.directory, ranks=[self.rank])
+        for step in steps[:-self.keep]:
+            path = os.path.join(self.directory, f'step-{step:09d}')
+            names = [f'rank-{self.rank}.done', f'rank-{self.rank}.pt']
+            if self.rank == 0:
+                names.append('replicated.pt')
+            for name in names:
+                try:
+                    os.remove(os.path.join(path, name))
+                except FileNotFoundError:
+                    pass
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass  # other ranks still have files in it
+
+
+def resume_position(epoch, batch, batches_in_epoch):
+    """
+    Return the `(epoch, batch)` to resume from after finishing `batch`, counted from 1, of `epoch`.
+
+    `batches_in_epoch` must be the count of this very epoch, which varies between epochs with a
+    `StreamingShardDataset`; after its last batch training resumes at the start of the next epoch.
+    """
+    return (epoch + 1, 0) if batch == batches_in_epoch else (epoch, batch)
+
+
+def checkpoint_steps(directory):
+    if not os.path.isdir(directory):
+        return []
+    matches = [_STEP_DIRECTORY.match(name) for name in os.listdir(directory)]
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def complete_steps(directory, ranks):
+    """Return the steps that have finished checkpoint files of all `ranks`."""
+    steps = []
+    for step in checkpoint_steps(directory):
+        path = os.path.join(directory, f'step-{step:09d}')
+        shards_done = all(os.path.exists(os.path.join(path, f'rank-{rank}.done')) for rank in ranks)
+        if shards_done and (0 not in ranks or os.path.exists(os.path.join(path, 'replicated.pt'))):
+            steps.append(step)
+    return steps
+
+
+def load_latest(directory):
+    """
+    Find the latest checkpoint every rank has its part of, and load it.
+
+    Returns `(step, replicated_state, local_state)` or `None` if there's nothing to resume from.
+    Ranks only check the shards they read themselves, so the directory may be local to each host.
+    The replicated state is read by rank 0 and broadcast to the other ranks.
+    """
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    available = complete_steps(directory, ranks=[rank])
+    everyone = [None] * world_size
+    dist.all_gather_object(everyone, available)
+    common = set(everyone[0]).intersection(*everyone[1:])
+    if not common:
+        return None
+    step = max(common)
+    path = os.path.join(directory, f'step-{step:09d}')
+    replicated = [torch.load(os.path.join(path, 'replicated.pt'), map_location='cpu') if rank == 0 else None]
+    dist.broadcast_object_list(replicated, src=0)
+    local = torch.load(os.path.join(path, f'rank-{rank}.pt'), map_location='cpu')
+    return step, replicated[0], local
@@ -0,0 +1,133 @@
+import torch.distributed as dist
+
+import cluster_config
+
+_groups = {}
+_groups_world = None
+
+
+def flat_all_reduce(tensor, async_op=False):
+    return dist.all_reduce(tensor, op=dist.ReduceOp.SUM, async_op=async_op)
+
+
+def reduce_scatter(output, inputs):
+    """
+    Sum `inputs[i]` over all ranks into `output` on rank `i`; `inputs` has one equally sized chunk per rank.
+
+    Gloo has no reduce-scatter, so there each chunk is reduced to its rank separately and all the reductions
+    run at once; this leaves partial sums in the `inputs` of the other ranks.
+    """
+    if dist.get_backend() != 'gloo':
+        dist.reduce_scatter(output, inputs, op=dist.ReduceOp.SUM)
+        return
+    works = [dist.reduce(chunk, dst=rank, op=dist.ReduceOp.SUM, async_op=True) for rank, chunk in enumerate(inputs)]
+    for work in works:
+        work.wait()
+    output.copy_(inputs[dist.get_rank()])
+
+
+def new_group(ranks):
+    """
+    Return the process group of `ranks`, creating it only the first time, unlike `dist.new_group()`.
+
+    Creating a group is a collective that connects its ranks anew, so every rank must ask for the same
+    groups in the same order, as with `dist.new_group()`. All ranks together are the default group itself.
+    Groups are forgotten when the default group is replaced.
+    """
+    global _groups_world
+    ranks = tuple(sorted(ranks))
+    if ranks == tuple(range(dist.get_world_size())):
+        return dist.group.WORLD
+    if _groups_world is not dist.group.WORLD:
+        _groups.clear()
+        _groups_world = dist.group.WORLD
+    if ranks not in _groups:
+        _groups[ranks] = dist.new_group(list(ranks))
+    return _groups[ranks]
+
+
+def member_hosts(nproc_per_node):
+    """
+    Return the host of every global rank, in rank order, for workers started by `launcher.launch()`.
+
+    Members are grouped by their `primary_local_ip`, so several members sharing a machine count as one host.
+    """
+    return cluster_config.load().rank_hosts(nproc_per_node)
+
+
+class _HierarchicalWork:
+
+    def __init__(self, all_reduce, tensor, work):
+        self.all_reduce = all_reduce
+        self.tensor = tensor
+        self.work = work
+
+    def wait(self):
+        if self.work is not None:
+            self.work.wait()
+        self.all_reduce._finish(self.tensor)
+        return True
+
+
+class HierarchicalAllReduce:
+    """
+    Sum a tensor over all ranks in three steps: reduce to a leader inside each host, all-reduce across
+    the host leaders, and broadcast the result back inside each host.
+
+    Only one process per host sends data over the network, instead of every process.
+    `hosts` names the host of every global rank; e.g. `member_hosts(nproc_per_node)`.
+    All ranks must construct this in the same order as it creates process groups.
+    """
+
+    def __init__(self, hosts):
+        if len(hosts) != dist.get_world_size():
+            raise ValueError(f'got hosts for {len(hosts)} ranks but the world size is {dist.get_world_size()}')
+        rank = dist.get_rank()
+        host_ranks = {}
+        for r, host in enumerate(hosts):
+            host_ranks.setdefault(host, []).append(r)
+        leaders = [ranks[0] for ranks in host_ranks.values()]
+
+        # `new_group()` must be called by every rank for every group, even the ones it isn't part of
+        self.local_group = None
+        for ranks in host_ranks.values():
+            group = new_group(ranks)
+            if rank in ranks:
+                self.local_group = group
+                self.local_size = len(ranks)
+                self.leader = ranks[0]
+        leader_group = new_group(leaders)
+        self.leader_group = leader_group if rank in leaders else None
+        self.host_count = len(leaders)
+
+    def __call__(self, tensor, async_op=False):
+        work = None
+        if self.local_size > 1:
+            work = dist.reduce(tensor, dst=self.leader, op=dist.ReduceOp.SUM, group=self.local_group, async_op=True)
+        handle = _HierarchicalWork(self, tensor, work)
+        if async_op:
+            # only the intra-host reduction overlaps with the caller, the rest runs in `wait()`
+            return handle
+        handle.wait()
+
+    def _finish(self, tensor):
+        if self.leader_group is not None and self.host_count > 1:
+            dist.all_reduce(tensor, op=dist.ReduceOp.SUM, group=self.leader_group)
+        if self.local_size > 1:
+            dist.broadcast(tensor, src=self.leader, group=self.local_group)
+
+
+def build_all_reduce(mode, nproc_per_node):
+    if mode == 'hierarchical':
+        return HierarchicalAllReduce(member_hosts(nproc_per_node))
+    return flat_all_reduce
+
+
+def add_all_reduce_argument(parser):
+    parser.add_argument(
+        '--all-reduce',
+        required=False,
+        default='flat',
+        choices=['flat', 'hierarchical'],
+        help='reduce across all ranks at once or inside each host first and then across hosts, default: flat',
+    )
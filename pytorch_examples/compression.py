@@ -0,0 +1,143 @@
+import torch
+import torch.distributed as dist
+
+
+class _Deferred:
+
+    def __init__(self, work, finish):
+        self.work = work
+        self.finish = finish
+
+    def wait(self):
+        if self.work is not None:
+            self.work.wait()
+        self.finish()
+        return True
+
+
+class NoCompression:
+    """Sum full precision gradients; the baseline the other compressors are compared against."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def reduce(self, tensor, key, all_reduce, async_op=False):
+        self.bytes_sent += tensor.numel() * tensor.element_size()
+        return all_reduce(tensor, async_op=async_op)
+
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
+
+class HalfPrecisionCompression:
+    """
+    Sum gradients cast to a 16-bit float `dtype`, halving the bytes sent.
+
+    The gloo backend can only reduce `torch.float16`; `torch.bfloat16` requires NCCL.
+    """
+
+    def __init__(self, dtype=torch.float16):
+        self.dtype = dtype
+        self.bytes_sent = 0
+
+    def reduce(self, tensor, key, all_reduce, async_op=False):
+        half = tensor.to(self.dtype)
+        self.bytes_sent += half.numel() * half.element_size()
+        work = all_reduce(half, async_op=True)
+        deferred = _Deferred(work, lambda: tensor.copy_(half))
+        if async_op:
+            return deferred
+        deferred.wait()
+
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
+
+class TopKCompression:
+    """
+    Sum only the largest `ratio` of each gradient's elements by magnitude, with error feedback.
+
+    Whatever isn't sent is kept in a residual per gradient (`key`) and added to the next gradient,
+    so small updates are delayed rather than lost, which keeps convergence close to the baseline.
+    As sparse gradients can't be summed in place, each rank's values and indexes are all-gathered across
+    the whole world and summed locally; `all_reduce` is therefore not used.
+    """
+
+    def __init__(self, ratio=0.01):
+        if not 0 < ratio <= 1:
+            raise ValueError(f'top-k ratio must be in (0, 1], got {ratio}')
+        self.ratio = ratio
+        self.residuals = {}
+        self.bytes_sent = 0
+
+    def reduce(self, tensor, key, all_reduce, async_op=False):
+        flat = tensor.view(-1)
+        residual = self.residuals.get(key)
+        if residual is None:
+            residual = self.residuals[key] = torch.zeros_like(flat)
+        residual += flat
+        k = max(1, int(self.ratio * flat.numel()))
+        _, indexes = residual.abs().topk(k, sorted=False)
+        values = residual[indexes]
+        residual[indexes] = 0
+
+        # pack values and int32 indexes (reinterpreted as float32 bits) into one message to gather once
+        packed = torch.cat([values.float(), indexes.int().view(torch.float32)])
+        self.bytes_sent += packed.numel() * packed.element_size()
+        gathered = [torch.empty_like(packed) for _ in range(dist.get_world_size())]
+        work = dist.all_gather(gathered, packed, async_op=True)
+
+        def finish():
+            received = torch.stack(gathered)
+            flat.zero_()
+            flat.index_add_(
+                0,
+                received[:, k:].contiguous().view(torch.int32).reshape(-1).long(),
+                received[:, :k].reshape(-1).to(flat.dtype),
+            )
+
+        deferred = _Deferred(work, finish)
+        if async_op:
+            return deferred
+        deferred.wait()
+
+    def state_dict(self):
+        # residuals differ per rank, so they belong to a rank's own checkpoint
+        return {'residuals': self.residuals}
+
+    def load_state_dict(self, state):
+        self.residuals = dict(state['residuals'])
+
+
+def build_compression(mode, topk_ratio=0.01):
+    if mode == 'fp16':
+        return HalfPrecisionCompression(torch.float16)
+    if mode == 'bf16':
+        return HalfPrecisionCompression(torch.bfloat16)
+    if mode == 'topk':
+        return TopKCompression(topk_ratio)
+    return NoCompression()
+
+
+def add_compression_arguments(parser, choices=('none', 'fp16', 'topk')):
+    parser.add_argument(
+        '--compression',
+        required=False,
+        default='none',
+        choices=list(choices),
+        help='how gradients are compressed before they are averaged across ranks, default: none',
+    )
+    parser.add_argument(
+        '--topk-ratio',
+        required=False,
+        default=0.01,
+        type=float,
+        metavar='RATIO',
+        help='the fraction of each gradient sent with --compression topk, default: 0.01',
+    )
@@ -0,0 +1,78 @@
+import torch
+import torch.nn.functional as F
+import valohai
+
+from collectives import flat_all_reduce
+
+
+def local_metrics(model, loader, num_classes=10):
+    """
+    Return the summed loss and the confusion matrix of `model` over `loader` as one flat float64 tensor.
+
+    The first entry is the summed loss and the rest is the `num_classes x num_classes` confusion matrix,
+    true labels in rows and predictions in columns, in row-major order. Counts in float64 are exact up to
+    2^53, so the tensors of all ranks can be summed with one all-reduce without losing a sample.
+    """
+    metrics = torch.zeros(1 + num_classes * num_classes, dtype=torch.float64)
+    training = model.training
+    model.eval()
+    with torch.no_grad():
+        for data, target in loader:
+            output = model(data)
+            metrics[0] += F.nll_loss(output.double(), target, reduction='sum')
+            predicted = output.argmax(dim=1)
+            metrics[1:] += torch.bincount(target * num_classes + predicted, minlength=num_classes * num_classes)
+    model.train(training)
+    return metrics
+
+
+def summarize(metrics, num_classes=10):
+    """Turn a tensor from `local_metrics()` into the mean loss, accuracy, sample count and confusion matrix."""
+    confusion = metrics[1:].view(num_classes, num_classes).long()
+    count = int(confusion.sum())
+    return {
+        'loss': metrics[0].item() / max(1, count),
+        'accuracy': int(confusion.trace()) / max(1, count),
+        'count': count,
+        'confusion': confusion,
+    }
+
+
+def evaluate(model, loader, num_classes=10, all_reduce=flat_all_reduce):
+    """
+    Evaluate `model` over this rank's `loader` and return the metrics of all ranks, see `summarize()`.
+
+    Every rank must call this, with loaders that together cover the evaluation set once, e.g. through a
+    `StridedSampler`; the metrics are combined with a single `all_reduce` of 1 + num_classes^2 values.
+    """
+    metrics = local_metrics(model, loader, num_classes)
+    all_reduce(metrics)
+    return summarize(metrics, num_classes)
+
+
+def log_metrics(epoch, metrics):
+    with valohai.logger() as logger:
+        logger.log('epoch', epoch)
+        logger.log('val_loss', metrics['loss'])
+        logger.log('val_accuracy', metrics['accuracy'])
+        logger.log('val_samples', metrics['count'])
+        logger.log('val_confusion', metrics['confusion'].tolist())
+
+
+def add_evaluation_arguments(parser):
+    parser.add_argument(
+        '--eval-every',
+        required=False,
+        default=1,
+        type=int,
+        metavar='EPOCHS',
+        help='evaluate on the test set split across all ranks after every this many epochs; 0 disables, default: 1',
+    )
+    parser.add_argument(
+        '--eval-batch-size',
+        required=False,
+        default=1000,
+        type=int,
+        metavar='COUNT',
+        help='the batch size of each rank during evaluation, default: 1000',
+    )
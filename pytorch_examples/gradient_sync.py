@@ -0,0 +1,124 @@
+import functools
+
+import torch.distributed as dist
+
+from collectives import flat_all_reduce
+from compression import NoCompression
+
+
+def average_gradients(model, all_reduce=flat_all_reduce, compression=None):
+    """Average gradients across all ranks with one blocking all-reduce per parameter."""
+    size = float(dist.get_world_size())
+    for index, param in enumerate(model.parameters()):
+        if compression is None:
+            all_reduce(param.grad.data)
+        else:
+            compression.reduce(param.grad.data, key=index, all_reduce=all_reduce)
+        param.grad.data /= size
+
+
+class _Bucket:
+
+    def __init__(self, index, params):
+        self.index = index
+        self.params = params
+        self.offsets = []
+        offset = 0
+        for param in params:
+            self.offsets.append(offset)
+            offset += param.numel()
+        self.buffer = params[0].new_zeros(offset)
+        self.ready = set()
+        self.work = None
+
+    def slice(self, index):
+        param = self.params[index]
+        offset = self.offsets[index]
+        return self.buffer[offset:offset + param.numel()].view_as(param)
+
+    def reset(self):
+        self.ready.clear()
+        self.work = None
+
+
+class GradientBucketer:
+    """
+    Average gradients across all ranks in fixed-size buckets, overlapping communication with `backward()`.
+
+    Parameters are packed into flat buckets in reverse registration order, which is roughly the order
+    autograd produces their gradients in. Each gradient is copied into its bucket from an autograd hook and
+    as soon as the last gradient of a bucket arrives, an asynchronous all-reduce is started for it while
+    `backward()` keeps computing the rest.
+
+    Call `synchronize()` after `backward()` and before `optimizer.step()` to wait for the reductions
+    and to write the averaged gradients back to `param.grad`. `all_reduce` is any of the sum all-reduce
+    implementations in `collectives` and `compression` any of the compressors in `compression`.
+    """
+
+    def __init__(self, parameters, bucket_size_mb=1.0, all_reduce=flat_all_reduce, compression=None):
+        self.all_reduce = all_reduce
+        self.compression = compression or NoCompression()
+        self.world_size = dist.get_world_size()
+        self.bucket_size = int(bucket_size_mb * 1024 * 1024)
+        self.buckets = self._build_buckets([p for p in parameters if p.requires_grad])
+        self._hooks = []
+        for bucket in self.buckets:
+            for index, param in enumerate(bucket.params):
+                hook = functools.partial(self._on_gradient, bucket, index)
+                self._hooks.append(param.register_hook(hook))
+
+    def _build_buckets(self, params):
+        buckets = []
+        current = []
+        current_size = 0
+        for param in reversed(params):
+            size = param.numel() * param.element_size()
+            compatible = not current or (param.dtype == current[0].dtype and param.device == current[0].device)
+            if current and (current_size + size > self.bucket_size or not compatible):
+                buckets.append(_Bucket(len(buckets), current))
+                current = []
+                current_size = 0
+            current.append(param)
+            current_size += size
+        if current:
+            buckets.append(_Bucket(len(buckets), current))
+        return buckets
+
+    def _on_gradient(self, bucket, index, grad):
+        if bucket.work is not None:
+            raise RuntimeError('a gradient was produced twice without calling synchronize() in between')
+        bucket.slice(index).copy_(grad)
+        bucket.ready.add(index)
+        if len(bucket.ready) == len(bucket.params):
+            self._launch(bucket)
+
+    def _launch(self, bucket):
+        bucket.work = self.compression.reduce(
+            bucket.buffer,
+            key=bucket.index,
+            all_reduce=self.all_reduce,
+            async_op=True,
+        )
+
+    def synchronize(self):
+        for bucket in self.buckets:
+            if bucket.work is None:
+                # parameters that didn't take part in this backward pass contribute zeros
+                for index in range(len(bucket.params)):
+                    if index not in bucket.ready:
+                        bucket.slice(index).zero_()
+                self._launch(bucket)
+        for bucket in self.buckets:
+            bucket.work.wait()
+            bucket.buffer /= self.world_size
+            for index, param in enumerate(bucket.params):
+                if param.grad is None:
+                    param.grad = bucket.slice(index).clone()
+                else:
+                    param.grad.copy_(bucket.slice(index))
+            bucket.reset()
+
+    def remove(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
@@ -0,0 +1,205 @@
+import datetime
+import os
+import time
+from multiprocessing.connection import wait
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+import cluster_config
+
+# imported once by the fork server instead of by every worker; the entry script brings torch and the rest along
+PRELOAD = ['__main__', 'torch', 'torch.distributed', 'torchvision', 'valohai']
+
+
+def add_launch_arguments(parser):
+    parser.add_argument(
+        '--nproc-per-node', '--nproc',
+        required=False,
+        default=1,
+        type=int,
+        metavar='COUNT',
+        help='the number of worker processes per host; usually the number of GPUs or CPU sockets, default: 1',
+    )
+    parser.add_argument(
+        '--master-port',
+        required=False,
+        default=1234,
+        type=int,
+        metavar='PORT',
+        help='the port the master listens on for process group initialization, default: 1234',
+    )
+    parser.add_argument(
+        '--start-method',
+        required=False,
+        default='forkserver',
+        choices=['forkserver', 'spawn'],
+        help='forkserver imports the heavy modules once and forks every worker from that; spawn starts every '
+             'worker as a fresh interpreter that imports them all again, default: forkserver',
+    )
+    parser.add_argument(
+        '--rendezvous-timeout',
+        required=False,
+        default=300,
+        type=float,
+        metavar='SECONDS',
+        help='how long workers wait to reach the master and each other, and for any collective, default: 300',
+    )
+    parser.add_argument(
+        '--connect-retries',
+        required=False,
+        default=5,
+        type=int,
+        metavar='COUNT',
+        help='how many more times a worker tries to connect to the master within the timeout, default: 5',
+    )
+
+
+def threads_per_process(nproc_per_node):
+    cpu_count = len(os.sched_getaffinity(0))
+    return max(1, cpu_count // nproc_per_node)
+
+
+def worker_context(start_method):
+    """Return the `multiprocessing` context to start workers with, preloading `PRELOAD` into a fork server."""
+    context = mp.get_context(start_method)
+    if start_method == 'forkserver':
+        context.set_forkserver_preload(PRELOAD)
+    return context
+
+
+def connect_store(host, port, timeout, retries):
+    """
+    Connect to the `TCPStore` of the master at `host:port`, trying `retries` more times if it fails.
+
+    The attempts share `timeout` seconds, with a growing pause between them; the store gets the whole
+    `timeout` for its operations once connected.
+    """
+    deadline = time.monotonic() + timeout
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        try:
+            store = dist.TCPStore(
+                host,
+                port,
+                is_master=False,
+                timeout=datetime.timedelta(seconds=max(1.0, remaining / (retries + 1 - attempt))),
+            )
+        except (RuntimeError, TimeoutError) as error:
+            remaining = deadline - time.monotonic()
+            if attempt == retries or remaining <= 0:
+                raise TimeoutError(f'could not connect to the master at {host}:{port} in {timeout} seconds '
+                                   f'with {retries + 1} attempts') from error
+            time.sleep(min(2 ** attempt * 0.1, remaining))
+            continue
+        store.set_timeout(datetime.timedelta(seconds=timeout))
+        return store
+
+
+def rendezvous(my_rank, world_size, backend, host, port, timeout=300, retries=5):
+    """Initialize the default process group through the `TCPStore` the master serves at `host:port`."""
+    store = connect_store(host, port, timeout, retries)
+    dist.init_process_group(
+        backend=backend,
+        store=store,
+        rank=my_rank,
+        world_size=world_size,
+        timeout=datetime.timedelta(seconds=timeout),
+    )
+
+
+def init(master, my_rank, local_rank, world_size, backend, num_threads, config, fn):
+    cluster_config.install(config)
+    torch.set_num_threads(num_threads)
+    if backend == 'nccl':
+        torch.cuda.set_device(local_rank)
+    # `master` is the host, port, timeout and retries of `rendezvous()`
+    rendezvous(my_rank, world_size, backend, *master)
+    fn(my_rank, world_size)
+
+
+def _init_local(rank, world_size, port, backend, fn, args):
+    torch.set_num_threads(threads_per_process(world_size))
+    if backend == 'nccl':
+        torch.cuda.set_device(rank)
+    dist.init_process_group(
+        init_method=f'tcp://127.0.0.1:{port}',
+        rank=rank,
+        world_size=world_size,
+        backend=backend,
+    )
+    fn(rank, world_size, *args)
+
+
+def launch_local(fn, nproc, port, backend='gloo', args=()):
+    """
+    Spawn `nproc` workers on this machine only, each calling `fn(rank, world_size, *args)` in one process group
+    that rendezvous on `127.0.0.1:port`, and return once all of them are done; for benchmarks and checks that
+    don't need a distributed configuration.
+    """
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_process(nproc))
+    mp.spawn(_init_local, args=(nproc, port, backend, fn, args), nprocs=nproc)
+
+
+def _exit_code(process):
+    # a worker killed by a signal reports it as a negative exit code, map it like a shell would
+    if process.exitcode < 0:
+        return 128 - process.exitcode
+    return process.exitcode
+
+
+def launch(fn, backend, settings):
+    """
+    Start `--nproc-per-node` workers on this host, each calling `fn(my_rank, world_size)` in an initialized
+    process group, and exit with the first non-zero worker exit code after stopping the remaining workers.
+
+    Global ranks are laid out host by host: `my_rank = member_rank * nproc_per_node + local_rank`.
+    The launcher on the master serves the `TCPStore` all workers rendezvous through, so it is up before
+    any of them start and outlives them.
+    """
+    nproc = settings.nproc_per_node
+    config = cluster_config.load()
+    master_ip = config.master.primary_local_ip
+    master = (master_ip, settings.master_port, settings.rendezvous_timeout, settings.connect_retries)
+    world_size = config.required_count * nproc
+    member_rank = config.rank
+    store = None
+    if config.me.is_master:
+        store = dist.TCPStore(
+            master_ip,
+            settings.master_port,
+            is_master=True,
+            wait_for_workers=False,
+            timeout=datetime.timedelta(seconds=settings.rendezvous_timeout),
+        )
+
+    # also covers OpenMP/MKL pools that read this when the worker imports torch
+    num_threads = threads_per_process(nproc)
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+
+    context = worker_context(settings.start_method)
+    processes = []
+    for local_rank in range(nproc):
+        my_rank = member_rank * nproc + local_rank
+        p = context.Process(
+            target=init,
+            args=(master, my_rank, local_rank, world_size, backend, num_threads, config, fn),
+        )
+        p.start()
+        processes.append(p)
+
+    exit_code = 0
+    running = list(processes)
+    while running:
+        wait([p.sentinel for p in running])
+        for p in [p for p in running if not p.is_alive()]:
+            running.remove(p)
+            if p.exitcode != 0 and exit_code == 0:
+                exit_code = _exit_code(p)
+                print(f'Worker {processes.index(p)} failed with exit code {p.exitcode}, stopping the others')
+                for other in running:
+                    other.terminate()
+    # serve the rendezvous until every worker is done
+    del store
+    exit(exit_code)
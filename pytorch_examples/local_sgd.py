@@ -0,0 +1,92 @@
+import torch.distributed as dist
+
+from collectives import flat_all_reduce
+
+
+class PeriodicAverager:
+    """
+    Average the model across ranks every `period` steps instead of averaging gradients on every step.
+
+    Between the averages every rank takes optimizer steps on its own gradients only ("local SGD").
+    The first `warmup_steps` steps are meant to be fully synchronous, see `synchronizes()`, and the counting
+    of periods starts after them. Parameters, and with `average_momentum` the optimizer's momentum buffers,
+    are copied into one flat buffer and averaged with a single all-reduce, so a period costs one collective
+    regardless of the number of tensors. `all_reduce` is any of the sum all-reduce implementations in
+    `collectives`; `bytes_sent` counts the bytes handed to it, like the compressors do.
+    """
+
+    def __init__(self, model, optimizer, period, warmup_steps=0, average_momentum=False, all_reduce=flat_all_reduce):
+        self.params = [p for p in model.parameters() if p.requires_grad]
+        self.optimizer = optimizer
+        self.period = period
+        self.warmup_steps = warmup_steps
+        self.average_momentum = average_momentum
+        self.all_reduce = all_reduce
+        self.world_size = dist.get_world_size()
+        self.buffer = None
+        self.bytes_sent = 0
+
+    def synchronizes(self, step):
+        """Tell whether the gradients of `step`, counting from 1, should be averaged as usual."""
+        return step <= self.warmup_steps
+
+    def step(self, step):
+        """Call after `optimizer.step()` of `step`, counting from 1; averages the model at the end of a period."""
+        if step > self.warmup_steps and (step - self.warmup_steps) % self.period == 0:
+            self.average()
+            return True
+        return False
+
+    def _tensors(self):
+        tensors = [p.data for p in self.params]
+        if self.average_momentum:
+            # optimizers without momentum, or before their first step, have no buffers to average
+            for param in self.params:
+                buffer = self.optimizer.state.get(param, {}).get('momentum_buffer')
+                if buffer is not None:
+                    tensors.append(buffer)
+        return tensors
+
+    def average(self):
+        tensors = self._tensors()
+        numel = sum(t.numel() for t in tensors)
+        if self.buffer is None or self.buffer.numel() != numel:
+            self.buffer = tensors[0].new_empty(numel)
+        offset = 0
+        for tensor in tensors:
+            self.buffer[offset:offset + tensor.numel()].copy_(tensor.view(-1))
+            offset += tensor.numel()
+        self.all_reduce(self.buffer)
+        self.bytes_sent += self.buffer.numel() * self.buffer.element_size()
+        self.buffer /= self.world_size
+        offset = 0
+        for tensor in tensors:
+            tensor.copy_(self.buffer[offset:offset + tensor.numel()].view_as(tensor))
+            offset += tensor.numel()
+
+
+def add_local_sgd_arguments(parser):
+    parser.add_argument(
+        '--local-steps',
+        required=False,
+        default=1,
+        type=int,
+        metavar='STEPS',
+        help='take this many optimizer steps on local gradients only and then average the model across ranks; '
+             '1 averages gradients on every step, default: 1',
+    )
+    parser.add_argument(
+        '--local-sgd-warmup',
+        required=False,
+        default=0,
+        type=int,
+        metavar='STEPS',
+        help='average gradients on every step for this many steps before switching to local steps, default: 0',
+    )
+    parser.add_argument(
+        '--average-momentum',
+        required=False,
+        default=False,
+        action='store_true',
+        help='average the momentum buffers along with the parameters after local steps',
+    )
@@ -0,0 +1,104 @@
+import fcntl
+import os
+import warnings
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from torchvision import datasets
+
+from partitioning import is_batch_index
+
+# the same normalization `transforms.Normalize((0.1307,), (0.3081,))` applies per sample
+MNIST_MEAN = 0.1307
+MNIST_STD = 0.3081
+
+
+def _split_name(train):
+    return 'train' if train else 'test'
+
+
+def _cache_paths(cache_dir, train):
+    split = _split_name(train)
+    return (
+        os.path.join(cache_dir, f'{split}-images.npy'),
+        os.path.join(cache_dir, f'{split}-labels.npy'),
+        os.path.join(cache_dir, f'{split}.complete'),
+    )
+
+
+def build_cache(root, cache_dir, train=True, chunk_size=8192):
+    """
+    Decode and normalize MNIST once into float32 image and int64 label `.npy` files under `cache_dir`.
+
+    Files are written under temporary names and renamed into place, with the `.complete` marker last,
+    so a half-written cache is never mistaken for a finished one.
+    """
+    images_path, labels_path, complete_path = _cache_paths(cache_dir, train)
+    dataset = datasets.MNIST(root=root, train=train, download=True)
+    raw_images = dataset.data
+    count = len(raw_images)
+
+    images = np.lib.format.open_memmap(f'{images_path}.tmp', mode='w+', dtype=np.float32, shape=(count, 1, 28, 28))
+    for start in range(0, count, chunk_size):
+        chunk = raw_images[start:start + chunk_size].numpy().astype(np.float32)
+        images[start:start + chunk_size, 0] = (chunk / 255 - MNIST_MEAN) / MNIST_STD
+    images.flush()
+    del images
+    np.save(f'{labels_path}.tmp.npy', dataset.targets.numpy().astype(np.int64))
+
+    os.replace(f'{images_path}.tmp', images_path)
+    os.replace(f'{labels_path}.tmp.npy', labels_path)
+    with open(complete_path, mode='w') as fp:
+        fp.write(f'{count}{os.linesep}')
+
+
+def prepare_cache(root, cache_dir, train=True):
+    """
+    Make sure the MNIST cache exists, building it if needed.
+
+    Safe to call from every local rank at once: the first rank to take the lock builds the cache
+    while the others block on the lock and find the finished cache once they get it.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    _, _, complete_path = _cache_paths(cache_dir, train)
+    if os.path.exists(complete_path):
+        return
+    with open(os.path.join(cache_dir, f'{_split_name(train)}.lock'), mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(complete_path):
+                build_cache(root, cache_dir, train=train)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MemoryMappedMNIST(Dataset):
+    """
+    MNIST samples served straight from the read-only memory-mapped cache, with no per-sample transform.
+
+    Every process mapping the same files shares a single copy of them in the page cache.
+    """
+
+    def __init__(self, cache_dir, train=True):
+        images_path, labels_path, _ = _cache_paths(cache_dir, train)
+        with warnings.catch_warnings():
+            # the arrays are mapped read-only, which torch warns about as it can't guard against writes
+            warnings.simplefilter('ignore', UserWarning)
+            self.images = torch.from_numpy(np.load(images_path, mmap_mode='r'))
+            self.labels = torch.from_numpy(np.load(labels_path, mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if is_batch_index(index):
+            # a whole batch at once, e.g. from a `BatchSampler` driving a `DataLoader(batch_size=None)`
+            index = torch.as_tensor(index, dtype=torch.int64)
+            return self.images[index], self.labels[index]
+        return self.images[index], int(self.labels[index])
+
+
+def cached_mnist(root, cache_dir, train=True):
+    prepare_cache(root, cache_dir, train=train)
+    return MemoryMappedMNIST(cache_dir, train=train)
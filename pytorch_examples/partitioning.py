@@ -0,0 +1,84 @@
+import math
+
+import torch
+from torch.utils.data import Sampler
+
+
+def shuffled_indexes(length, seed):
+    """Return a seeded permutation of `range(length)` as a compact tensor, identical on every rank."""
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    dtype = torch.int32 if length <= torch.iinfo(torch.int32).max else torch.int64
+    return torch.randperm(length, generator=generator, dtype=dtype)
+
+
+def is_batch_index(index):
+    """Tell whether `index` asks for a whole batch of samples rather than a single one."""
+    if torch.is_tensor(index):
+        return index.dim() > 0
+    return isinstance(index, (list, tuple))
+
+
+class DistributedEpochSampler(Sampler):
+    """
+    Sample this rank's share of a dataset, reshuffling the whole dataset every epoch.
+
+    The order is derived from `(seed, epoch)` so all ranks agree on it without communicating;
+    call `set_epoch()` before iterating each epoch, with an `offset` of already consumed samples
+    when resuming in the middle of one. Every rank gets exactly the same number of samples,
+    and thus batches, so collectives stay in lockstep: with `drop_last` the samples that don't divide
+    evenly across ranks are left out of the epoch, otherwise the order is padded by repeating its start.
+    """
+
+    def __init__(self, dataset, num_replicas, rank, seed=1234, drop_last=False):
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f'rank {rank} is out of range for {num_replicas} replicas')
+        self.dataset_len = len(dataset)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.offset = 0
+        if drop_last:
+            self.num_samples = self.dataset_len // num_replicas
+        else:
+            self.num_samples = math.ceil(self.dataset_len / num_replicas)
+        self.total_size = self.num_samples * num_replicas
+
+    def set_epoch(self, epoch, offset=0):
+        if not 0 <= offset <= self.num_samples:
+            raise ValueError(f'offset {offset} is out of range for {self.num_samples} samples')
+        self.epoch = epoch
+        self.offset = offset
+
+    def __len__(self):
+        return self.num_samples - self.offset
+
+    def __iter__(self):
+        indexes = shuffled_indexes(self.dataset_len, self.seed + self.epoch)
+        if self.total_size > self.dataset_len:
+            repeats = math.ceil(self.total_size / self.dataset_len)
+            indexes = indexes.repeat(repeats)
+        indexes = indexes[self.rank:self.total_size:self.num_replicas]
+        return iter(indexes[self.offset:].tolist())
+
+
+class StridedSampler(Sampler):
+    """
+    Sample every `num_replicas`-th index of a dataset in order, starting from `rank`.
+
+    Every sample goes to exactly one rank even when the dataset doesn't divide evenly, so some ranks get
+    one sample more than others; meant for evaluation, where ranks don't need the same number of batches.
+    """
+
+    def __init__(self, dataset, num_replicas, rank):
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f'rank {rank} is out of range for {num_replicas} replicas')
+        self.indexes = range(rank, len(dataset), num_replicas)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __iter__(self):
+        return iter(self.indexes)
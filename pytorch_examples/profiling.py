@@ -0,0 +1,166 @@
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import valohai
+
+PHASES = ['data', 'forward', 'backward', 'communication', 'optimizer', 'other']
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def find_stragglers(step_times, threshold):
+    """Return the ranks whose step time is more than `threshold` times the median of all ranks."""
+    median_time = median(step_times)
+    return [rank for rank, step_time in enumerate(step_times) if step_time > median_time * threshold]
+
+
+class StepProfiler:
+    """
+    Time the phases of every training step and compare them across ranks every `log_every` steps.
+
+    Call `mark(phase)` right after a phase ends, the time since the previous mark is added to it,
+    and `step_end(step)` after the step, which adds any time since the last mark to `other`.
+    The first mark of a step is usually `data`, so the time spent waiting for the next batch counts there.
+    Every `log_every` steps, the average phase times of all ranks are all-gathered as one small tensor and
+    rank 0 logs their median and maximum; a rank slower than `straggler_threshold` times the median step
+    for `straggler_windows` windows in a row is reported as a straggler.
+    Every window of consecutive steps in `trace_steps` is recorded with `torch.profiler` into
+    `trace_dir/rank-N-step-S.json`, where S is the first step of the window; `start_step` is the step
+    training continues after, and `close()` ends a trace still being recorded. Call `reset_clock()` after
+    work between steps that belongs to no phase, such as evaluation or handing off a checkpoint.
+    """
+
+    def __init__(
+        self,
+        log_every=100,
+        straggler_threshold=1.2,
+        straggler_windows=3,
+        trace_steps=(),
+        trace_dir='/valohai/outputs/traces',
+        start_step=0,
+    ):
+        self.log_every = log_every
+        self.straggler_threshold = straggler_threshold
+        self.straggler_windows = straggler_windows
+        self.trace_steps = set(trace_steps)
+        self.trace_dir = trace_dir
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        self.totals = [0.0] * len(PHASES)
+        self.steps = 0
+        self.slow_windows = [0] * self.world_size
+        self._profiler = None
+        self._trace_start = None
+        self._trace(start_step)
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.totals[PHASES.index(phase)] += now - self._last
+        self._last = now
+
+    def step_end(self, step):
+        self.mark('other')
+        self.steps += 1
+        self._trace(step)
+        if step % self.log_every == 0:
+            self._report(step)
+            self.reset_clock()  # leave the reporting out of the next step
+
+    def reset_clock(self):
+        """Leave the time since the last mark out of every phase."""
+        self._last = time.perf_counter()
+
+    def close(self):
+        if self._profiler is not None:
+            self._profiler.stop()
+            os.makedirs(self.trace_dir, exist_ok=True)
+            name = f'rank-{self.rank}-step-{self._trace_start}.json'
+            self._profiler.export_chrome_trace(os.path.join(self.trace_dir, name))
+            self._profiler = None
+
+    def _trace(self, step):
+        # `step` just ended, so a trace window starts if the next step should be traced
+        tracing = self._profiler is not None
+        if not tracing and step + 1 in self.trace_steps:
+            self._profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+            self._profiler.start()
+            self._trace_start = step + 1
+        elif tracing and step + 1 not in self.trace_steps:
+            self.close()
+
+    def _report(self, step):
+        averages = torch.tensor(self.totals, dtype=torch.float64) / max(1, self.steps)
+        gathered = [torch.empty_like(averages) for _ in range(self.world_size)]
+        dist.all_gather(gathered, averages)
+        self.totals = [0.0] * len(PHASES)
+        self.steps = 0
+
+        phase_times = torch.stack(gathered)  # ranks x phases
+        step_times = phase_times.sum(dim=1).tolist()
+        slow = set(find_stragglers(step_times, self.straggler_threshold))
+        self.slow_windows = [count + 1 if rank in slow else 0 for rank, count in enumerate(self.slow_windows)]
+        stragglers = [rank for rank, count in enumerate(self.slow_windows) if count >= self.straggler_windows]
+        if self.rank != 0:
+            return
+        with valohai.logger() as logger:
+            logger.log('step', step)
+            for phase, times in zip(PHASES, phase_times.t().tolist()):
+                logger.log(f'{phase}_ms_median', median(times) * 1000)
+                logger.log(f'{phase}_ms_max', max(times) * 1000)
+            logger.log('step_ms_median', median(step_times) * 1000)
+            logger.log('step_ms_max', max(step_times) * 1000)
+            logger.log('slowest_rank', max(range(self.world_size), key=lambda rank: step_times[rank]))
+            logger.log('stragglers', stragglers)
+        if stragglers:
+            print(f'Step {step}: ranks {stragglers} have been over {self.straggler_threshold}x the median step time '
+                  f'for {self.straggler_windows} reports in a row')
+
+
+def parse_steps(value):
+    """Parse a step selection such as `50-55,100` into a list of steps."""
+    steps = []
+    for part in value.split(','):
+        first, _, last = part.partition('-')
+        steps.extend(range(int(first), int(last or first) + 1))
+    return steps
+
+
+def add_profiling_arguments(parser):
+    parser.add_argument(
+        '--profile-every',
+        required=False,
+        default=100,
+        type=int,
+        metavar='STEPS',
+        help='how often step phase timings are gathered from all ranks and logged; 0 disables, default: 100',
+    )
+    parser.add_argument(
+        '--straggler-threshold',
+        required=False,
+        default=1.2,
+        type=float,
+        metavar='RATIO',
+        help='flag ranks whose step time is this many times the median for 3 reports in a row, default: 1.2',
+    )
+    parser.add_argument(
+        '--trace-steps',
+        required=False,
+        default=[],
+        type=parse_steps,
+        metavar='STEPS',
+        help='steps to record with torch.profiler, e.g. 50-55, default: none',
+    )
+    parser.add_argument(
+        '--trace-dir',
+        required=False,
+        default='/valohai/outputs/traces',
+        metavar='DIRECTORY',
+        help='where profiler traces are written, default: /valohai/outputs/traces',
+    )
@@ -0,0 +1,246 @@
+"""
+A framework-neutral on-disk format for datasets larger than memory, and the NumPy code to write and stream it.
+
+A dataset is a directory of `shard-NNNNN.bin` files and an `index.json`. Every record has the same fields
+with fixed dtypes and shapes, stored back to back as raw little-endian bytes, so a shard is a plain array
+of fixed-length records that any reader, e.g. `tf.data.FixedLengthRecordDataset`, can consume.
+The index names the fields and the record count of every shard, and is written last, so a dataset
+with an index is complete.
+
+Readers split the shards into blocks of consecutive records, give every consumer its own blocks of a
+seeded per-epoch permutation, read each block with one sequential read and shuffle records through a
+bounded buffer, so memory use depends on the block and buffer sizes but not on the size of the dataset.
+"""
+
+import fcntl
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+INDEX_NAME = 'index.json'
+FORMAT_VERSION = 1
+
+
+def record_dtype(fields):
+    """Return the NumPy structured dtype of a record with `fields`, e.g. from `read_index()['fields']`."""
+    return np.dtype([(f['name'], np.dtype(f['dtype']).newbyteorder('<'), tuple(f['shape'])) for f in fields])
+
+
+class ShardWriter:
+    """
+    Write records into shards of about `shard_size_mb` under `directory`.
+
+    `fields` is a list of `(name, dtype, shape)` of every record. Pass batches of records to `write()` as
+    one array per field, all with the same number of records, and call `close()`, or use the writer as a
+    context manager, to finish the last shard and write the index. Shards are written under temporary
+    names and renamed into place.
+    """
+
+    def __init__(self, directory, fields, shard_size_mb=64):
+        self.directory = directory
+        self.fields = [
+            {'name': name, 'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+            for name, dtype, shape in fields
+        ]
+        self.dtype = record_dtype(self.fields)
+        self.records_per_shard = max(1, int(shard_size_mb * 1024 * 1024) // self.dtype.itemsize)
+        self.shards = []
+        self._file = None
+        self._records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, **arrays):
+        count = len(next(iter(arrays.values())))
+        records = np.empty(count, dtype=self.dtype)
+        for field in self.fields:
+            records[field['name']] = arrays[field['name']]
+        start = 0
+        while start < count:
+            if self._file is None:
+                self._open()
+            end = min(count, start + self.records_per_shard - self._records)
+            self._file.write(records[start:end].tobytes())
+            self._records += end - start
+            start = end
+            if self._records == self.records_per_shard:
+                self._finish_shard()
+
+    def close(self):
+        if self._file is not None:
+            self._finish_shard()
+        index = {
+            'version': FORMAT_VERSION,
+            'fields': self.fields,
+            'record_bytes': self.dtype.itemsize,
+            'shards': self.shards,
+        }
+        path = os.path.join(self.directory, INDEX_NAME)
+        with open(f'{path}.tmp', mode='w') as fp:
+            json.dump(index, fp, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+
+    def _open(self):
+        self._name = f'shard-{len(self.shards):05d}.bin'
+        self._file = open(os.path.join(self.directory, f'{self._name}.tmp'), mode='wb')
+        self._records = 0
+
+    def _finish_shard(self):
+        self._file.close()
+        os.replace(os.path.join(self.directory, f'{self._name}.tmp'), os.path.join(self.directory, self._name))
+        self.shards.append({'file': self._name, 'records': self._records})
+        self._file = None
+
+
+def read_index(directory):
+    with open(os.path.join(directory, INDEX_NAME)) as fp:
+        index = json.load(fp)
+    if index.get('version') != FORMAT_VERSION:
+        raise ValueError(f'{directory} has format version {index.get("version")}, expected {FORMAT_VERSION}')
+    return index
+
+
+def prepare_shards(directory, build):
+    """
+    Make sure a sharded dataset exists in `directory`, calling `build(directory)` to write it if needed.
+
+    Safe to call from every process on a host at once, like `mnist_cache.prepare_cache()`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, INDEX_NAME)):
+        return
+    with open(os.path.join(directory, 'build.lock'), mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(os.path.join(directory, INDEX_NAME)):
+                build(directory)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def split_blocks(index, block_records):
+    """
+    Return `(shard_file, first_record, count)` for every block of at most `block_records` records.
+
+    A shard is split into blocks of as equal sizes as possible rather than full blocks and a short one.
+    """
+    blocks = []
+    for shard in index['shards']:
+        count = -(-shard['records'] // block_records)
+        bounds = [shard['records'] * i // count for i in range(count + 1)]
+        blocks.extend((shard['file'], first, end - first) for first, end in zip(bounds, bounds[1:]))
+    return blocks
+
+
+def assign_blocks(blocks, slot, slots, seed):
+    """
+    Return the blocks of consumer `slot` out of `slots` for the epoch `seed` stands for, and its record quota.
+
+    Blocks are dealt round-robin from a seeded permutation, so consumers never share a block and all of them
+    agree on the split without communicating. The quota is the smallest number of records any consumer got,
+    so every consumer can produce exactly that many; the few records over it are left out of this epoch only.
+    """
+    if len(blocks) < slots:
+        raise ValueError(f'{len(blocks)} blocks cannot be split between {slots} consumers, use smaller blocks')
+    order = np.random.default_rng(seed).permutation(len(blocks))
+    quota = min(sum(blocks[b][2] for b in order[s::slots]) for s in range(slots))
+    return [blocks[b] for b in order[slot::slots]], quota
+
+
+def _read(directory, blocks, dtype, quota):
+    remaining = quota
+    for name, first, count in blocks:
+        if remaining <= 0:
+            return
+        count = min(count, remaining)
+        remaining -= count
+        yield np.fromfile(os.path.join(directory, name), dtype=dtype, count=count, offset=first * dtype.itemsize)
+
+
+def read_blocks(directory, blocks, dtype, quota, read_ahead=4):
+    """
+    Yield the records of `blocks`, up to `quota` of them, one block per array.
+
+    A background thread reads up to `read_ahead` blocks ahead, so reading overlaps with what the consumer does.
+    """
+    if read_ahead < 1:
+        yield from _read(directory, blocks, dtype, quota)
+        return
+    ready = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+    failure = []
+
+    def put(item):
+        # gives up once the consumer is gone, so an abandoned reader never blocks forever
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for block in _read(directory, blocks, dtype, quota):
+                if not put(block):
+                    return
+        except BaseException as error:
+            failure.append(error)
+        put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = ready.get()
+            if block is None:
+                break
+            yield block
+        if failure:
+            raise failure[0]
+    finally:
+        stop.set()
+
+
+def shuffled_batches(blocks, batch_size, buffer_size, rng):
+    """
+    Shuffle the records of the `blocks` arrays through a buffer of about `buffer_size` records into batches.
+
+    Once the buffer is full, every batch is drawn at random from it and the holes are filled from its end.
+    The last batch may be smaller than `batch_size`.
+    """
+    buffer = None
+    count = 0
+    for block in blocks:
+        if buffer is None:
+            buffer = np.empty(max(buffer_size, batch_size) + len(block), dtype=block.dtype)
+        elif count + len(block) > len(buffer):
+            buffer = np.concatenate([buffer[:count], np.empty(len(block), dtype=block.dtype)])
+        buffer[count:count + len(block)] = block
+        count += len(block)
+        while count >= max(buffer_size, batch_size):
+            picked = rng.choice(count, size=batch_size, replace=False)
+            batch = buffer[picked]
+            # move the records after the new end into the holes before it
+            end = count - batch_size
+            holes = picked[picked < end]
+            tail = np.setdiff1d(np.arange(end, count), picked, assume_unique=True)
+            buffer[holes] = buffer[tail]
+            count = end
+            yield batch
+    if count:
+        rest = buffer[rng.permutation(count)]
+        for start in range(0, count, batch_size):
+            yield rest[start:start + batch_size]
@@ -0,0 +1,141 @@
+import functools
+import math
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision import datasets
+
+from mnist_cache import MNIST_MEAN, MNIST_STD
+from shard_format import (
+    ShardWriter,
+    assign_blocks,
+    prepare_shards,
+    read_blocks,
+    read_index,
+    record_dtype,
+    shuffled_batches,
+    split_blocks,
+)
+
+MNIST_FIELDS = [('image', 'uint8', (28, 28)), ('label', 'int64', ())]
+
+# how many blocks every loader worker gets at least, unless that needs blocks of a single record
+MIN_BLOCKS_PER_WORKER = 8
+
+
+def _to_tensors(batch):
+    return tuple(torch.from_numpy(np.ascontiguousarray(batch[name])) for name in batch.dtype.names)
+
+
+class StreamingShardDataset(IterableDataset):
+    """
+    Stream this rank's share of a `shard_format` dataset as shuffled batches, without loading the dataset.
+
+    Every epoch, the blocks of the dataset are dealt between all `num_replicas * num_workers` loader workers
+    from a permutation derived from `(seed, epoch)`, so no two workers read the same records and all ranks
+    agree on the split without communicating. Each worker reads its blocks in order with `read_ahead` blocks
+    read in the background and shuffles them through a buffer of `shuffle_buffer` records. All workers yield
+    the same number of records, so every rank gets the same number of batches and collectives stay in
+    lockstep; the records over that are left out of the epoch. Blocks are made smaller than `block_records`
+    when needed to give every worker at least `MIN_BLOCKS_PER_WORKER` of them, which keeps that remainder small.
+
+    Use it with `DataLoader(dataset, batch_size=None, num_workers=num_workers)` as it batches by itself.
+    Like `DistributedEpochSampler`, call `set_epoch()` before every epoch, with an `offset` of samples this
+    rank already consumed when resuming in the middle of one. `transform` turns a NumPy batch of records
+    into what the loader yields, by default a tensor per field.
+    """
+
+    def __init__(
+        self,
+        directory,
+        batch_size,
+        rank=0,
+        num_replicas=1,
+        num_workers=0,
+        transform=None,
+        shuffle_buffer=10000,
+        block_records=1024,
+        read_ahead=4,
+        seed=1234,
+    ):
+        index = read_index(directory)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.num_workers = num_workers
+        self.transform = transform or _to_tensors
+        self.shuffle_buffer = shuffle_buffer
+        self.read_ahead = read_ahead
+        self.seed = seed
+        self.dtype = record_dtype(index['fields'])
+        records = sum(shard['records'] for shard in index['shards'])
+        slots = num_replicas * self.workers_per_rank
+        self.blocks = split_blocks(index, max(1, min(block_records, records // (slots * MIN_BLOCKS_PER_WORKER))))
+        self.epoch = 0
+        self.offset = 0
+
+    @property
+    def workers_per_rank(self):
+        return max(1, self.num_workers)
+
+    def set_epoch(self, epoch, offset=0):
+        self.epoch = epoch
+        self.offset = offset
+
+    def _batches_per_worker(self):
+        slots = self.num_replicas * self.workers_per_rank
+        _, quota = assign_blocks(self.blocks, 0, slots, self.seed + self.epoch)
+        return math.ceil(quota / self.batch_size)
+
+    def __len__(self):
+        return self._batches_per_worker() * self.workers_per_rank - self.offset // self.batch_size
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker = 0 if info is None else info.id
+        if (info.num_workers if info else 0) != self.num_workers:
+            raise RuntimeError(f'the dataset was set up for {self.num_workers} loader workers, not the actual count')
+        slot = self.rank * self.workers_per_rank + worker
+        seed = self.seed + self.epoch
+        blocks, quota = assign_blocks(self.blocks, slot, self.num_replicas * self.workers_per_rank, seed)
+        # a loader takes batches from its workers in turn, so a rank's skipped batches are spread the same way
+        skipped = self.offset // self.batch_size
+        skip = skipped // self.workers_per_rank + (worker < skipped % self.workers_per_rank)
+        rng = np.random.default_rng([seed, slot])
+        records = read_blocks(self.directory, blocks, self.dtype, quota, read_ahead=self.read_ahead)
+        for number, batch in enumerate(shuffled_batches(records, self.batch_size, self.shuffle_buffer, rng)):
+            if number >= skip:
+                yield self.transform(batch)
+
+
+def write_mnist_shards(root, directory, train=True, shard_size_mb=4, chunk_size=8192):
+    dataset = datasets.MNIST(root=root, train=train, download=True)
+    with ShardWriter(directory, MNIST_FIELDS, shard_size_mb=shard_size_mb) as writer:
+        for start in range(0, len(dataset.data), chunk_size):
+            writer.write(
+                image=dataset.data[start:start + chunk_size].numpy(),
+                label=dataset.targets[start:start + chunk_size].numpy(),
+            )
+
+
+def normalize_mnist(batch):
+    """Turn a batch of raw MNIST records into the normalized images and labels `datasets.MNIST` would give."""
+    images = torch.from_numpy(np.ascontiguousarray(batch['image'])).unsqueeze(1).float()
+    images = (images / 255 - MNIST_MEAN) / MNIST_STD
+    return images, torch.from_numpy(np.ascontiguousarray(batch['label']))
+
+
+def sharded_mnist(root, directory, batch_size, rank, num_replicas, num_workers=0, train=True, **kwargs):
+    """Write MNIST into shards under `directory` unless already there, and stream it like `StreamingShardDataset`."""
+    prepare_shards(directory, functools.partial(write_mnist_shards, root, train=train))
+    return StreamingShardDataset(
+        directory,
+        batch_size,
+        rank=rank,
+        num_replicas=num_replicas,
+        num_workers=num_workers,
+        transform=normalize_mnist,
+        **kwargs,
+    )
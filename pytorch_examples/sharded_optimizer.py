@@ -0,0 +1,95 @@
+import torch
+import torch.distributed as dist
+from torch import nn
+
+from collectives import reduce_scatter
+
+
+def optimizer_state_bytes(optimizer):
+    """Return the bytes of the tensors in the state of a `torch.optim` optimizer, e.g. momentum buffers."""
+    return sum(
+        value.numel() * value.element_size()
+        for state in optimizer.state.values()
+        for value in state.values()
+        if torch.is_tensor(value)
+    )
+
+
+class ShardedOptimizer:
+    """
+    Partition the optimizer state and the update across ranks, like stage 1 of ZeRO.
+
+    The parameters are moved into one flat buffer, padded to a multiple of the world size, and every rank
+    owns a contiguous 1/world_size slice of it. `synchronize()` reduce-scatters the gradients, so each rank
+    gets the average gradient of its slice only, and `step()` runs `optimizer_class` on that slice and then
+    all-gathers the updated slices back into the parameters on every rank. Only the owned slice has
+    optimizer state, e.g. momentum buffers, so that state is 1/world_size of the replicated one.
+
+    The parameters and their `.grad` stay views of the flat buffers, so the model, its `state_dict()` and
+    autograd work on them as before; `zero_grad()` zeroes the gradients in place instead of dropping them.
+    `state_dict()` only covers this rank's slice and has to be checkpointed per rank.
+    `bytes_sent` counts the bytes handed to the reduce-scatter and the all-gather, like the compressors do.
+    """
+
+    def __init__(self, parameters, optimizer_class, **defaults):
+        self.params = [p for p in parameters if p.requires_grad]
+        if len({(p.dtype, p.device) for p in self.params}) != 1:
+            raise ValueError('all parameters must have the same dtype and device to be sharded')
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        self.numel = sum(p.numel() for p in self.params)
+        self.shard_size = -(-self.numel // self.world_size)
+
+        padded = self.shard_size * self.world_size
+        self.flat_params = self.params[0].new_zeros(padded)
+        self.flat_grads = self.params[0].new_zeros(padded)
+        offset = 0
+        for param in self.params:
+            end = offset + param.numel()
+            self.flat_params[offset:end].copy_(param.data.view(-1))
+            param.data = self.flat_params[offset:end].view_as(param)
+            param.grad = self.flat_grads[offset:end].view_as(param)
+            offset = end
+
+        start = self.rank * self.shard_size
+        self.shard = nn.Parameter(self.flat_params[start:start + self.shard_size])
+        self.shard.grad = torch.zeros_like(self.shard)
+        self.optimizer = optimizer_class([self.shard], **defaults)
+        self._synchronized = False
+        self.bytes_sent = 0
+
+    def zero_grad(self):
+        self.flat_grads.zero_()
+        self._synchronized = False
+
+    def synchronize(self):
+        """Average the gradients of this rank's slice across all ranks; the rest of `flat_grads` is left undefined."""
+        reduce_scatter(self.shard.grad, list(self.flat_grads.split(self.shard_size)))
+        self.shard.grad /= self.world_size
+        self.bytes_sent += self.flat_grads.numel() * self.flat_grads.element_size()
+        self._synchronized = True
+
+    def step(self):
+        if not self._synchronized:
+            self.synchronize()
+        self.optimizer.step()
+        # the slice is copied first as it is also one of the outputs
+        dist.all_gather(list(self.flat_params.split(self.shard_size)), self.shard.detach().clone())
+        self.bytes_sent += self.shard.numel() * self.shard.element_size()
+        self._synchronized = False
+
+    def state_dict(self):
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.optimizer.load_state_dict(state_dict)
+
+    def memory_report(self):
+        """Return the optimizer state bytes of this rank and what every rank would hold without sharding."""
+        shard_state = optimizer_state_bytes(self.optimizer)
+        return {
+            'optimizer_state_bytes': shard_state,
+            'replicated_state_bytes': shard_state * self.numel // self.shard_size,
+            'shard_numel': self.shard_size,
+            'total_numel': self.numel,
+        }
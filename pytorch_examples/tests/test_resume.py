@@ -0,0 +1,79 @@
+import numpy as np
+
+from checkpointing import resume_position
+from shard_format import ShardWriter
+from sharded_dataset import StreamingShardDataset
+
+BATCH_SIZE = 16
+
+
+def write_shards(directory, count=10007, records_per_shard=1000):
+    # shards that don't divide into equal blocks, so the quota of a rank changes with the block permutation
+    with ShardWriter(str(directory), [('value', 'int64', ())], shard_size_mb=records_per_shard * 8 / 1024 / 1024) as w:
+        w.write(value=np.arange(count))
+
+
+def streamed(directory, seed=1234):
+    return StreamingShardDataset(str(directory), BATCH_SIZE, rank=0, num_replicas=3, shuffle_buffer=64, seed=seed)
+
+
+def epoch_lengths(dataset, epochs):
+    lengths = []
+    for epoch in range(epochs):
+        dataset.set_epoch(epoch)
+        lengths.append(len(dataset))
+    return lengths
+
+
+def train(dataset, epochs, start_epoch=0, start_batch=0, stop_after=None):
+    """Go through the batches the way `04_gloo_mnist.py` does, returning them and the last checkpoint position."""
+    seen = []
+    position = None
+    for epoch in range(start_epoch, epochs):
+        first_batch = start_batch if epoch == start_epoch else 0
+        dataset.set_epoch(epoch, offset=first_batch * BATCH_SIZE)
+        batches_per_epoch = first_batch + len(dataset)
+        for batch, (values,) in enumerate(dataset, start=first_batch + 1):
+            seen.append((epoch, values.tolist()))
+            position = resume_position(epoch, batch, batches_per_epoch)
+            if (epoch, batch) == stop_after:
+                return seen, position
+    return seen, position
+
+
+def test_epoch_lengths_differ(tmp_path):
+    write_shards(tmp_path)
+    dataset = streamed(tmp_path)
+    for epoch in range(4):
+        dataset.set_epoch(epoch)
+        assert len(dataset) == sum(1 for _ in dataset)
+    assert len(set(epoch_lengths(dataset, 10))) > 1
+
+
+def test_resume_after_the_last_batch_of_a_longer_epoch(tmp_path):
+    write_shards(tmp_path)
+    # a seed whose second epoch has more batches than its first
+    seed, (_, batches) = next(
+        (seed, lengths) for seed in range(100)
+        for lengths in [epoch_lengths(streamed(tmp_path, seed), 2)] if lengths[0] < lengths[1]
+    )
+    expected, _ = train(streamed(tmp_path, seed), 3)
+
+    before, position = train(streamed(tmp_path, seed), 3, stop_after=(1, batches))
+    assert position == (2, 0)
+    after, _ = train(streamed(tmp_path, seed), 3, *position)
+    assert before + after == expected
+
+
+def test_resume_in_the_middle_of_an_epoch(tmp_path):
+    write_shards(tmp_path)
+    expected, _ = train(streamed(tmp_path), 2)
+    before, position = train(streamed(tmp_path), 2, stop_after=(0, 7))
+    assert position == (0, 7)
+    after, _ = train(streamed(tmp_path), 2, *position)
+    assert before + after == expected
+
+
+def test_resume_position():
+    assert resume_position(3, 5, 10) == (3, 5)
+    assert resume_position(3, 10, 10) == (4, 0)
@@ -0,0 +1,56 @@
+import contextlib
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class LossModel(nn.Module):
+    """Compute the loss of `model` on a batch, so the forward pass and the loss get compiled together."""
+
+    def __init__(self, model):
+        super(LossModel, self).__init__()
+        self.model = model
+
+    def forward(self, data, target):
+        return F.nll_loss(self.model(data), target)
+
+
+def build_loss_fn(model, compile_mode='none'):
+    """
+    Wrap `model` into a `loss_fn(data, target)`, compiled with TorchScript (`script`) or `torch.compile()`.
+
+    The compiled function shares the parameters of `model`, so optimizers, gradient hooks and
+    `model.state_dict()` keep working on `model` itself.
+    """
+    loss_model = LossModel(model)
+    if compile_mode == 'script':
+        return torch.jit.script(loss_model)
+    if compile_mode == 'compile':
+        return torch.compile(loss_model)
+    return loss_model
+
+
+def autocast(precision):
+    """Return the context the forward pass and the loss run in; `bf16` runs eligible CPU ops in bfloat16."""
+    if precision == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def add_training_mode_arguments(parser):
+    parser.add_argument(
+        '--precision',
+        required=False,
+        default='fp32',
+        choices=['fp32', 'bf16'],
+        help='run the forward pass and the loss in float32 or with bfloat16 autocast on the CPU, default: fp32',
+    )
+    parser.add_argument(
+        '--compile',
+        required=False,
+        default='none',
+        choices=['none', 'script', 'compile'],
+        help='run the model and the loss eagerly, as TorchScript or through torch.compile() (PyTorch 2.0 or newer), '
+             'default: none',
+    )
@@ -1,22 +1,42 @@
 # Source: https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras
 
+import argparse
 import json
 import os
 import uuid
 
-import numpy as np
 import tensorflow as tf
 import valohai
 
+import cluster_config
+from evaluation import DistributedEvaluation, add_evaluation_arguments
+from input_pipeline import add_input_arguments, mnist_dataset_fn
+from models import add_model_arguments, build_and_compile_cnn_model, set_precision
+from profiling import StepProfiler, add_profiling_arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--backup-dir',
+    required=False,
+    default='/valohai/outputs/backup',
+    metavar='DIRECTORY',
+    help='where the training state is backed up every epoch and restored from, default: /valohai/outputs/backup',
+)
+add_input_arguments(parser)
+add_model_arguments(parser)
+add_profiling_arguments(parser)
+add_evaluation_arguments(parser)
+settings = parser.parse_args()
+
 # Populate "TF_CONFIG" environment variable with the cluster configuration
 # and identity of this worker.
-primary_local_ips = [m.primary_local_ip for m in valohai.distributed.members()]
-worker_addresses = [f'{ip}:12345' for ip in primary_local_ips]
+config = cluster_config.load()
+worker_addresses = [f'{ip}:12345' for ip in config.primary_local_ips]
 tf_config = {
     'cluster': {
         'worker': worker_addresses
     },
-    'task': {'type': 'worker', 'index': valohai.distributed.rank}
+    'task': {'type': 'worker', 'index': config.rank}
 }
 os.environ['TF_CONFIG'] = json.dumps(tf_config)
 
@@ -30,33 +50,6 @@ strategy = tf.distribute.MultiWorkerMirroredStrategy(
 )
 
 
-def mnist_dataset(batch_size):
-    (x_train, y_train), _ = tf.keras.datasets.mnist.load_data()
-    x_train = x_train / np.float32(255)
-    y_train = y_train.astype(np.int64)
-    train_dataset = tf.data.Dataset.from_tensor_slices(
-        (x_train, y_train)
-    ).shuffle(60000).repeat().batch(batch_size)
-    return train_dataset
-
-
-def build_and_compile_cnn_model():
-    model = tf.keras.Sequential([
-        tf.keras.layers.InputLayer(input_shape=(28, 28)),
-        tf.keras.layers.Reshape(target_shape=(28, 28, 1)),
-        tf.keras.layers.Conv2D(32, 3, activation='relu'),
-        tf.keras.layers.Flatten(),
-        tf.keras.layers.Dense(128, activation='relu'),
-        tf.keras.layers.Dense(10)
-    ])
-    model.compile(
-        loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-        optimizer=tf.keras.optimizers.SGD(learning_rate=0.001),
-        metrics=['accuracy'],
-    )
-    return model
-
-
 def log_metadata(epoch, logs):
     """Helper function to log training metrics"""
     with valohai.logger() as logger:
@@ -66,19 +59,37 @@ def log_metadata(epoch, logs):
 
 
 per_worker_batch_size = 64
-num_workers = valohai.distributed.required_count
+num_workers = config.required_count
 global_batch_size = per_worker_batch_size * num_workers
-multi_worker_dataset = mnist_dataset(global_batch_size)
+# each worker builds its own pipeline over its own shard of the data
+multi_worker_dataset = strategy.distribute_datasets_from_function(mnist_dataset_fn(settings, global_batch_size))
 
+set_precision(settings.precision)
 with strategy.scope():
-    multi_worker_model = build_and_compile_cnn_model()
+    multi_worker_model = build_and_compile_cnn_model(jit_compile=settings.jit_compile)
 
 callback = tf.keras.callbacks.LambdaCallback(on_epoch_end=log_metadata)
-multi_worker_model.fit(multi_worker_dataset, epochs=3, steps_per_epoch=70, callbacks=[callback])
+# Back up the model, optimizer and epoch at the end of every epoch so a preempted run resumes from there
+# instead of starting over; the chief writes the backup and it's removed once training finishes.
+# https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras#fault_tolerance
+backup = tf.keras.callbacks.BackupAndRestore(backup_dir=settings.backup_dir)
+callbacks = [callback, backup]
+if settings.profile_every:
+    callbacks.append(StepProfiler(
+        strategy,
+        log_every=settings.profile_every,
+        straggler_threshold=settings.straggler_threshold,
+        trace_steps=settings.trace_steps,
+        trace_dir=settings.trace_dir,
+    ))
+if settings.eval_every:
+    # every worker evaluates its share of the test set and the chief logs the combined metrics
+    callbacks.append(DistributedEvaluation(strategy, every=settings.eval_every, batch_size=settings.eval_batch_size))
+multi_worker_model.fit(multi_worker_dataset, epochs=3, steps_per_epoch=70, callbacks=callbacks)
 
 # Typically, only the model saved by the chief should be referenced for restoring or serving.
 # https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras#model_saving_and_loading
-if valohai.distributed.me().is_master:
+if config.me.is_master:
     suffix = uuid.uuid4()
     output_path = valohai.outputs().path(f'model-{suffix}.h5')
     multi_worker_model.save(output_path)
@@ -0,0 +1,130 @@
+# Source: https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras
+
+import argparse
+import json
+import os
+import uuid
+
+import tensorflow as tf
+import valohai
+
+import cluster_config
+from collectives import (
+    CollectiveTimer,
+    add_collective_arguments,
+    communication_options,
+    half_precision_aggregator,
+    pick_implementation,
+)
+from evaluation import DistributedEvaluation, add_evaluation_arguments
+from input_pipeline import add_input_arguments, mnist_dataset_fn
+from models import add_model_arguments, build_and_compile_cnn_model, set_precision
+from profiling import StepProfiler, add_profiling_arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--backup-dir',
+    required=False,
+    default='/valohai/outputs/backup',
+    metavar='DIRECTORY',
+    help='where the training state is backed up every epoch and restored from, default: /valohai/outputs/backup',
+)
+parser.add_argument(
+    '--worker-port',
+    required=False,
+    default=12345,
+    type=int,
+    metavar='PORT',
+    help='the port workers talk to each other on; members sharing a machine use the next ones, default: 12345',
+)
+parser.add_argument('--epochs', required=False, default=3, type=int, metavar='COUNT', help='default: 3')
+parser.add_argument('--steps-per-epoch', required=False, default=70, type=int, metavar='COUNT', help='default: 70')
+add_collective_arguments(parser)
+add_input_arguments(parser)
+add_model_arguments(parser)
+add_profiling_arguments(parser)
+add_evaluation_arguments(parser)
+settings = parser.parse_args()
+
+# Populate "TF_CONFIG" environment variable with the cluster configuration
+# and identity of this worker.
+config = cluster_config.load()
+worker_addresses = [
+    f'{m.primary_local_ip}:{settings.worker_port + config.by_ip(m.primary_local_ip).index(m)}'
+    for m in config.members
+]
+tf_config = {
+    'cluster': {
+        'worker': worker_addresses
+    },
+    'task': {'type': 'worker', 'index': config.rank}
+}
+os.environ['TF_CONFIG'] = json.dumps(tf_config)
+
+# Listing the devices doesn't create any "ops" so the implementation can be picked before the strategy exists.
+implementation = pick_implementation(settings.implementation)
+options = communication_options(implementation, settings.bytes_per_pack, settings.timeout_seconds)
+strategy = tf.distribute.MultiWorkerMirroredStrategy(communication_options=options)
+print('Collective settings:', json.dumps({
+    'implementation': implementation,
+    'bytes_per_pack': settings.bytes_per_pack,
+    'timeout_seconds': settings.timeout_seconds,
+    'fp16_all_reduce': settings.fp16_all_reduce,
+    'replicas': strategy.num_replicas_in_sync,
+}))
+
+
+def log_metadata(epoch, logs):
+    """Helper function to log training metrics"""
+    with valohai.logger() as logger:
+        logger.log('epoch', epoch)
+        logger.log('accuracy', logs['accuracy'])
+        logger.log('loss', logs['loss'])
+
+
+per_worker_batch_size = 64
+num_workers = config.required_count
+global_batch_size = per_worker_batch_size * num_workers
+# each worker builds its own pipeline over its own shard of the data
+multi_worker_dataset = strategy.distribute_datasets_from_function(mnist_dataset_fn(settings, global_batch_size))
+
+set_precision(settings.precision)
+with strategy.scope():
+    aggregator = half_precision_aggregator(options) if settings.fp16_all_reduce else None
+    multi_worker_model = build_and_compile_cnn_model(
+        gradient_aggregator=aggregator,
+        jit_compile=settings.jit_compile,
+    )
+
+callback = tf.keras.callbacks.LambdaCallback(on_epoch_end=log_metadata)
+# time the gradient all-reduce at the end of every epoch to see how much of a step it takes
+collective_timer = CollectiveTimer(strategy, options, dtype=tf.float16 if settings.fp16_all_reduce else tf.float32)
+# Back up the model, optimizer and epoch at the end of every epoch so a preempted run resumes from there
+# instead of starting over; the chief writes the backup and it's removed once training finishes.
+# https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras#fault_tolerance
+backup = tf.keras.callbacks.BackupAndRestore(backup_dir=settings.backup_dir)
+callbacks = [callback, collective_timer, backup]
+if settings.profile_every:
+    callbacks.append(StepProfiler(
+        strategy,
+        log_every=settings.profile_every,
+        straggler_threshold=settings.straggler_threshold,
+        trace_steps=settings.trace_steps,
+        trace_dir=settings.trace_dir,
+    ))
+if settings.eval_every:
+    # every worker evaluates its share of the test set and the chief logs the combined metrics
+    callbacks.append(DistributedEvaluation(strategy, every=settings.eval_every, batch_size=settings.eval_batch_size))
+multi_worker_model.fit(
+    multi_worker_dataset,
+    epochs=settings.epochs,
+    steps_per_epoch=settings.steps_per_epoch,
+    callbacks=callbacks,
+)
+
+# Typically, only the model saved by the chief should be referenced for restoring or serving.
+# https://www.tensorflow.org/tutorials/distribute/multi_worker_with_keras#model_saving_and_loading
+if config.me.is_master:
+    suffix = uuid.uuid4()
+    output_path = valohai.outputs().path(f'model-{suffix}.h5')
+    multi_worker_model.save(output_path)
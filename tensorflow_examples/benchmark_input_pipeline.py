@@ -0,0 +1,123 @@
+"""
+Compare training steps/sec of the original MNIST input pipeline and `input_pipeline.mnist_dataset()`.
+
+Runs `--workers` CPU-only `MultiWorkerMirroredStrategy` workers on this machine for every pipeline and
+reports the steps/sec of the chief after `--warmup` untimed steps.
+
+    python tensorflow_examples/benchmark_input_pipeline.py --workers 2 --steps 200
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from input_pipeline import load_mnist, mnist_dataset
+from models import build_and_compile_cnn_model
+
+
+def original_dataset(global_batch_size):
+    # the pipeline the examples used before: normalized in NumPy and shuffled as a whole on every worker
+    (x_train, y_train), _ = tf.keras.datasets.mnist.load_data()
+    x_train = x_train / np.float32(255)
+    y_train = y_train.astype(np.int64)
+    return tf.data.Dataset.from_tensor_slices((x_train, y_train)).shuffle(60000).repeat().batch(global_batch_size)
+
+
+class StepTimer:
+
+    def __init__(self, warmup):
+        self.warmup = warmup
+        self.steps = 0
+        self.start = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        if self.steps == self.warmup:
+            self.start = time.perf_counter()
+
+    def steps_per_second(self):
+        return (self.steps - self.warmup) / (time.perf_counter() - self.start)
+
+
+def worker(index, pipeline, port, settings, results):
+    os.environ['TF_CONFIG'] = json.dumps({
+        'cluster': {'worker': [f'127.0.0.1:{port + i}' for i in range(settings.workers)]},
+        'task': {'type': 'worker', 'index': index},
+    })
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING,
+        ),
+    )
+    global_batch_size = settings.batch_size * settings.workers
+    if pipeline == 'original':
+        dataset = original_dataset(global_batch_size)
+    else:
+        images, labels = load_mnist()
+        dataset = strategy.distribute_datasets_from_function(
+            lambda input_context: mnist_dataset(
+                images,
+                labels,
+                global_batch_size,
+                input_context,
+                shuffle_buffer=settings.shuffle_buffer,
+            ),
+        )
+    with strategy.scope():
+        model = build_and_compile_cnn_model()
+
+    timer = StepTimer(settings.warmup)
+    callback = tf.keras.callbacks.LambdaCallback(on_train_batch_end=timer.on_train_batch_end)
+    model.fit(dataset, epochs=1, steps_per_epoch=settings.warmup + settings.steps, callbacks=[callback], verbose=0)
+    if index == 0:
+        results.put((pipeline, timer.steps_per_second()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default=2, type=int, metavar='COUNT', help='local workers, default: 2')
+    parser.add_argument('--port', default=12345, type=int, metavar='PORT', help='first worker port, default: 12345')
+    parser.add_argument('--steps', default=200, type=int, metavar='COUNT', help='timed steps, default: 200')
+    parser.add_argument('--warmup', default=20, type=int, metavar='COUNT', help='untimed steps, default: 20')
+    parser.add_argument('--batch-size', default=64, type=int, metavar='COUNT', help='per worker, default: 64')
+    parser.add_argument('--shuffle-buffer', default=10000, type=int, metavar='COUNT', help='default: 10000')
+    parser.add_argument(
+        '--pipelines',
+        default=['original', 'sharded'],
+        nargs='+',
+        choices=['original', 'sharded'],
+        help='input pipelines to compare, the first is the baseline, default: original sharded',
+    )
+    settings = parser.parse_args()
+    if settings.warmup < 1:
+        parser.error('--warmup must be at least 1')
+
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''  # inherited by the workers, which then only see the CPU
+    # a strategy can only be set up once per process, so every pipeline gets fresh workers
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    rows = []
+    for pipeline in settings.pipelines:
+        processes = [
+            context.Process(target=worker, args=(index, pipeline, settings.port, settings, results))
+            for index in range(settings.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                raise SystemExit(f'a {pipeline} worker failed with exit code {process.exitcode}')
+        rows.append(results.get())
+        settings.port += settings.workers
+
+    print(f'{settings.workers} workers, {settings.batch_size} examples per worker and step, {settings.steps} steps')
+    print(f'{"pipeline":>10} {"steps/s":>9} {"speedup":>8}')
+    baseline = rows[0][1]
+    for pipeline, steps_per_second in rows:
+        print(f'{pipeline:>10} {steps_per_second:>9.1f} {steps_per_second / baseline:>7.2f}x')
@@ -0,0 +1,112 @@
+"""
+Compare samples/sec and accuracy of the precision and XLA modes of the Keras MNIST model on the CPU.
+
+Trains the same model from the same seed for `--steps` steps with every mode in one process, and fails if
+a mode's loss on a fixed batch before training differs from the first mode's by more than
+`--forward-tolerance`, or if its loss on that batch after training is more than `--tolerance` above the
+first mode's. Modes are written as `PRECISION` or `PRECISION+jit`, e.g. `bf16+jit`.
+
+    python tensorflow_examples/benchmark_training_modes.py --modes fp32 bf16 fp32+jit bf16+jit
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from input_pipeline import load_mnist, mnist_dataset
+from models import build_and_compile_cnn_model, set_precision
+
+
+class StepTimer(tf.keras.callbacks.Callback):
+
+    def __init__(self, warmup):
+        super().__init__()
+        self.warmup = warmup
+        self.steps = 0
+        self.start = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        if self.steps == self.warmup:
+            self.start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def train(images, labels, precision, jit_compile, settings):
+    set_precision(precision)
+    tf.keras.utils.set_random_seed(1234)
+    model = build_and_compile_cnn_model(jit_compile=jit_compile)
+    # the loss on the same examples before and after training
+    probe_images, probe_labels = images[:settings.batch_size] / np.float32(255), labels[:settings.batch_size]
+    initial_loss = model.evaluate(probe_images, probe_labels, batch_size=settings.batch_size, verbose=0)[0]
+
+    dataset = mnist_dataset(images, labels, settings.batch_size, tf.distribute.InputContext())
+    timer = StepTimer(settings.warmup)
+    model.fit(dataset, epochs=1, steps_per_epoch=settings.warmup + settings.steps, callbacks=[timer], verbose=0)
+    samples_per_second = settings.steps * settings.batch_size / timer.elapsed()
+    final_loss = model.evaluate(probe_images, probe_labels, batch_size=settings.batch_size, verbose=0)[0]
+    return initial_loss, final_loss, samples_per_second
+
+
+def parse_mode(mode):
+    precision, _, compiler = mode.partition('+')
+    return precision, compiler == 'jit'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', default=200, type=int, metavar='COUNT', help='timed training steps, default: 200')
+    parser.add_argument('--warmup', default=10, type=int, metavar='COUNT', help='untimed steps, default: 10')
+    parser.add_argument('--batch-size', default=128, type=int, metavar='COUNT', help='default: 128')
+    parser.add_argument(
+        '--forward-tolerance',
+        default=0.02,
+        type=float,
+        metavar='FRACTION',
+        help='how much the loss on a fixed batch may differ from the baseline before training, default: 0.02',
+    )
+    parser.add_argument(
+        '--tolerance',
+        default=0.1,
+        type=float,
+        metavar='FRACTION',
+        help='how much higher than the baseline the loss after training may be, default: 0.1',
+    )
+    parser.add_argument(
+        '--modes',
+        default=['fp32', 'bf16', 'fp32+jit', 'bf16+jit'],
+        nargs='+',
+        metavar='MODE',
+        help='modes to compare, the first is the baseline, default: fp32 bf16 fp32+jit bf16+jit',
+    )
+    settings = parser.parse_args()
+    if settings.warmup < 1:
+        parser.error('--warmup must be at least 1')
+    for mode in settings.modes:
+        precision, _, compiler = mode.partition('+')
+        if precision not in ['fp32', 'bf16'] or compiler not in ['', 'jit']:
+            parser.error(f'unknown mode {mode}')
+
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    images, labels = load_mnist()
+    results = [(mode, *train(images, labels, *parse_mode(mode), settings)) for mode in settings.modes]
+
+    baseline_initial, baseline_loss, baseline_speed = results[0][1:]
+    print(f'{settings.steps} steps of {settings.batch_size} samples, loss on a fixed batch before and after')
+    print(f'{"mode":>10} {"initial":>8} {"final":>8} {"samples/s":>10} {"speedup":>8}')
+    failed = []
+    for mode, initial, loss, speed in results:
+        close = abs(initial - baseline_initial) <= baseline_initial * settings.forward_tolerance
+        converged = loss <= baseline_loss * (1 + settings.tolerance)
+        if not (close and converged):
+            failed.append(mode)
+        status = 'ok' if close and converged else 'LOSS DIFFERS' if not close else 'DID NOT CONVERGE'
+        print(f'{mode:>10} {initial:>8.4f} {loss:>8.4f} {speed:>10.0f} {speed / baseline_speed:>7.2f}x  {status}')
+    if failed:
+        sys.exit(1)
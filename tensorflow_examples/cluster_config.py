@@ -0,0 +1,143 @@
+import json
+from collections import namedtuple
+
+from valohai import paths
+
+_FIELDS = ['rank', 'member_id', 'identity', 'job_id', 'announce_time', 'local_ips', 'public_ips', 'exposed_ports']
+
+
+class Member(namedtuple('Member', _FIELDS)):
+    """A member of the distributed group; the same fields as `valohai.distributed.members()` items."""
+
+    __slots__ = ()
+
+    @property
+    def is_master(self):
+        return self.rank == 0
+
+    @property
+    def primary_local_ip(self):
+        if not self.local_ips:
+            raise RuntimeError('There are no local IPs in the distributed worker network configuration')
+        return self.local_ips[0]
+
+    @property
+    def primary_public_ip(self):
+        if not self.public_ips:
+            raise RuntimeError('There are no public IPs in the distributed worker network configuration')
+        return self.public_ips[0]
+
+
+def _rank_order(member_ids):
+    # the same ordering `valohai.distributed` ranks members with: numerically if every id is a number
+    try:
+        return sorted(range(len(member_ids)), key=lambda i: int(member_ids[i]))
+    except ValueError:
+        return sorted(range(len(member_ids)), key=lambda i: member_ids[i])
+
+
+class ClusterConfig:
+    """
+    The distributed configuration parsed once, with members indexed by rank, member id and local IP.
+
+    Pickles as one tuple per field instead of an object per member, so handing it to spawned processes
+    is cheap and spares every one of them from reading and parsing `distributed.json` again; see `install()`.
+    """
+
+    def __init__(self, group_name, member_id, required_count, members):
+        self.group_name = group_name
+        self.member_id = member_id
+        self.required_count = required_count
+        self.members = tuple(members)  # in rank order
+        self._by_member_id = {m.member_id: m for m in self.members}
+        self._by_ip = {}
+        for m in self.members:
+            for ip in m.local_ips:
+                self._by_ip.setdefault(ip, []).append(m)
+        self.me = self._by_member_id[member_id]
+        self.master = self.members[0]
+        self.rank = self.me.rank
+
+    @classmethod
+    def from_json_data(cls, json_data):
+        entries = json_data['members']
+        order = _rank_order([entry['member_id'] for entry in entries])
+        members = []
+        for rank, index in enumerate(order):
+            entry = entries[index]
+            network = entry['network']
+            members.append(Member(
+                rank=rank,
+                member_id=entry['member_id'],
+                identity=entry['identity'],
+                job_id=entry['job_id'],
+                announce_time=entry['announce_time'],
+                local_ips=tuple(network['local_ips']),
+                public_ips=tuple(network['public_ips']),
+                exposed_ports=network['exposed_ports'],
+            ))
+        config = json_data['config']
+        return cls(config['group_name'], config['member_id'], config['required_count'], members)
+
+    def __reduce__(self):
+        columns = tuple(zip(*self.members)) if self.members else ((),) * len(_FIELDS)
+        return _from_columns, (self.group_name, self.member_id, self.required_count, columns)
+
+    def __len__(self):
+        return len(self.members)
+
+    def by_rank(self, rank):
+        return self.members[rank]
+
+    def by_member_id(self, member_id):
+        try:
+            return self._by_member_id[member_id]
+        except KeyError:
+            raise RuntimeError(f'No member with id {member_id}') from None
+
+    def by_ip(self, ip):
+        """Return the members with `ip` among their local IPs, as several members may share a machine."""
+        return list(self._by_ip.get(ip, []))
+
+    @property
+    def primary_local_ips(self):
+        return [m.primary_local_ip for m in self.members]
+
+    def host_ranks(self, nproc_per_node=1):
+        """
+        Group the global ranks of processes started by `nproc_per_node` per member by `primary_local_ip`.
+
+        Ranks are laid out member by member, `member_rank * nproc_per_node + local_rank`, and hosts are in
+        the order of their lowest rank.
+        """
+        groups = {}
+        for m in self.members:
+            first = m.rank * nproc_per_node
+            groups.setdefault(m.primary_local_ip, []).extend(range(first, first + nproc_per_node))
+        return groups
+
+    def rank_hosts(self, nproc_per_node=1):
+        """Return the `primary_local_ip` of every global rank, in rank order; see `host_ranks()`."""
+        return [m.primary_local_ip for m in self.members for _ in range(nproc_per_node)]
+
+
+def _from_columns(group_name, member_id, required_count, columns):
+    return ClusterConfig(group_name, member_id, required_count, [Member(*values) for values in zip(*columns)])
+
+
+_config = None
+
+
+def load():
+    """Return the configuration of this distributed task, reading `distributed.json` only the first time."""
+    global _config
+    if _config is None:
+        with open(paths.get_distributed_config_path()) as fp:
+            _config = ClusterConfig.from_json_data(json.load(fp))
+    return _config
+
+
+def install(config):
+    """Make `load()` return `config`, e.g. one received from the parent process, without reading any files."""
+    global _config
+    _config = config
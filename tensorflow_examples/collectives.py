@@ -0,0 +1,136 @@
+import time
+
+import tensorflow as tf
+import valohai
+
+IMPLEMENTATIONS = {
+    'ring': tf.distribute.experimental.CommunicationImplementation.RING,
+    'nccl': tf.distribute.experimental.CommunicationImplementation.NCCL,
+}
+
+
+def pick_implementation(implementation='auto'):
+    """Resolve `auto` to `nccl` if this worker has GPUs and to `ring` otherwise."""
+    if implementation == 'auto':
+        return 'nccl' if tf.config.list_physical_devices('GPU') else 'ring'
+    return implementation
+
+
+def communication_options(implementation, bytes_per_pack=0, timeout_seconds=None):
+    return tf.distribute.experimental.CommunicationOptions(
+        bytes_per_pack=bytes_per_pack,
+        timeout_seconds=timeout_seconds,
+        implementation=IMPLEMENTATIONS[implementation],
+    )
+
+
+def half_precision_aggregator(options):
+    """
+    Build a Keras `gradient_aggregator` that sums gradients across replicas as `float16`, halving the bytes sent.
+
+    Keras already scales the loss by the number of replicas, so a sum is the average gradient.
+    """
+
+    def aggregate(grads_and_vars):
+        grads_and_vars = list(grads_and_vars)
+        halves = [tf.cast(grad, tf.float16) for grad, _ in grads_and_vars]
+        summed = tf.distribute.get_replica_context().all_reduce(tf.distribute.ReduceOp.SUM, halves, options=options)
+        return [(tf.cast(grad, var.dtype), var) for grad, (_, var) in zip(summed, grads_and_vars)]
+
+    return aggregate
+
+
+class CollectiveTimer(tf.keras.callbacks.Callback):
+    """
+    Log the average step time and the time one gradient all-reduce takes at the end of every epoch.
+
+    The all-reduce is timed outside of training on zero tensors shaped like the model's trainable
+    variables, with the same options and dtype training uses, so tuning e.g. `bytes_per_pack` shows up
+    directly. Every worker runs the timed all-reduce together as the callback runs on all of them.
+    """
+
+    def __init__(self, strategy, options, dtype=tf.float32, iterations=10):
+        super().__init__()
+        self.strategy = strategy
+        self.options = options
+        self.dtype = dtype
+        self.iterations = iterations
+        self._all_reduce = None
+        self._step_started = None
+        self._step_times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_started = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step_times.append(time.perf_counter() - self._step_started)
+
+    def _build(self):
+        tensors = [tf.zeros(variable.shape, self.dtype) for variable in self.model.trainable_variables]
+
+        def replica_fn():
+            context = tf.distribute.get_replica_context()
+            summed = context.all_reduce(tf.distribute.ReduceOp.SUM, tensors, options=self.options)
+            # a single value to wait for, as GPU collectives may still run after the call returns
+            return tf.add_n([tf.reduce_sum(tf.cast(tensor, tf.float32)) for tensor in summed])
+
+        @tf.function
+        def all_reduce():
+            return self.strategy.run(replica_fn)
+
+        return all_reduce
+
+    def measure(self):
+        """Return the average seconds of one all-reduce of all the gradients."""
+        if self._all_reduce is None:
+            self._all_reduce = self._build()
+            self._all_reduce()  # trace and warm up
+        start = time.perf_counter()
+        for _ in range(self.iterations):
+            result = self._all_reduce()
+        for value in self.strategy.experimental_local_results(result):
+            value.numpy()
+        return (time.perf_counter() - start) / self.iterations
+
+    def on_epoch_end(self, epoch, logs=None):
+        collective = self.measure()
+        step = sum(self._step_times) / max(1, len(self._step_times))
+        self._step_times = []
+        with valohai.logger() as logger:
+            logger.log('epoch', epoch)
+            logger.log('step_ms', step * 1000)
+            logger.log('all_reduce_ms', collective * 1000)
+            logger.log('all_reduce_share', collective / step if step else 0.0)
+
+
+def add_collective_arguments(parser):
+    parser.add_argument(
+        '--implementation',
+        required=False,
+        default='auto',
+        choices=['auto', *IMPLEMENTATIONS],
+        help='the all-reduce implementation; auto picks nccl if there are GPUs and ring otherwise, default: auto',
+    )
+    parser.add_argument(
+        '--bytes-per-pack',
+        required=False,
+        default=0,
+        type=int,
+        metavar='BYTES',
+        help='pack gradients into all-reduces of about this size, 0 lets TensorFlow decide, default: 0',
+    )
+    parser.add_argument(
+        '--timeout-seconds',
+        required=False,
+        default=None,
+        type=float,
+        metavar='SECONDS',
+        help='fail a collective that takes longer than this instead of waiting forever, default: no timeout',
+    )
+    parser.add_argument(
+        '--fp16-all-reduce',
+        required=False,
+        default=False,
+        action='store_true',
+        help='sum gradients across workers as float16, halving the bytes sent',
+    )
@@ -0,0 +1,121 @@
+import numpy as np
+import tensorflow as tf
+import valohai
+
+from input_pipeline import evaluation_dataset, load_mnist
+
+
+def summarize(metrics, num_classes=10):
+    """Turn summed loss and confusion matrix values into the mean loss, accuracy, sample count and the matrix."""
+    confusion = np.rint(metrics[1:]).astype(np.int64).reshape(num_classes, num_classes)
+    count = int(confusion.sum())
+    return {
+        'loss': float(metrics[0]) / max(1, count),
+        'accuracy': int(np.trace(confusion)) / max(1, count),
+        'count': count,
+        'confusion': confusion,
+    }
+
+
+class DistributedEvaluation(tf.keras.callbacks.Callback):
+    """
+    Evaluate the model on the MNIST test set split across all workers every `every` epochs.
+
+    Every worker takes every `worker_count`-th example of the test set, so each example is evaluated once
+    however unevenly the set divides, and sums the loss and a confusion matrix over its share in batches
+    of `batch_size` without touching the gradients. The sums of all workers are combined with one
+    all-reduce of 1 + num_classes^2 float64 values, exact for any realistic count, and the chief logs them.
+    """
+
+    def __init__(self, strategy, every=1, batch_size=1000, num_classes=10):
+        super().__init__()
+        self.strategy = strategy
+        self.every = every
+        self.batch_size = batch_size
+        self.num_classes = num_classes
+        self._dataset = None
+        self._batch_metrics = None
+        self._all_reduce = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.every:
+            return
+        metrics = self.evaluate()
+        if self._worker_index() != 0:
+            return
+        print(f'Epoch {epoch}: test loss {metrics["loss"]:.4f}, accuracy {metrics["accuracy"]:.4f} '
+              f'over {metrics["count"]} examples')
+        with valohai.logger() as logger:
+            logger.log('epoch', epoch)
+            logger.log('val_loss', metrics['loss'])
+            logger.log('val_accuracy', metrics['accuracy'])
+            logger.log('val_samples', metrics['count'])
+            logger.log('val_confusion', metrics['confusion'].tolist())
+
+    def evaluate(self):
+        """Return the metrics of all workers over the whole test set; every worker must call this."""
+        if self._dataset is None:
+            self._build()
+        metrics = tf.zeros(1 + self.num_classes * self.num_classes, dtype=tf.float64)
+        for images, labels in self._dataset:
+            metrics += self._batch_metrics(images, labels)
+        metrics = self.strategy.experimental_local_results(self._all_reduce(metrics))[0]
+        return summarize(metrics.numpy(), self.num_classes)
+
+    def _worker_index(self):
+        return self.strategy.cluster_resolver.task_id or 0
+
+    def _worker_count(self):
+        return len(self.strategy.cluster_resolver.cluster_spec().as_dict().get('worker', [])) or 1
+
+    def _build(self):
+        images, labels = load_mnist(train=False)
+        self._dataset = evaluation_dataset(images, labels, self.batch_size, self._worker_index(), self._worker_count())
+        num_classes = self.num_classes
+        replicas_per_worker = self.strategy.num_replicas_in_sync // self._worker_count()
+
+        @tf.function
+        def batch_metrics(images, labels):
+            logits = self.model(images, training=False)
+            losses = tf.keras.losses.sparse_categorical_crossentropy(labels, logits, from_logits=True)
+            predicted = tf.argmax(logits, axis=1, output_type=labels.dtype)
+            confusion = tf.math.bincount(
+                tf.cast(labels * num_classes + predicted, tf.int32),
+                minlength=num_classes * num_classes,
+                maxlength=num_classes * num_classes,
+                dtype=tf.float64,
+            )
+            return tf.concat([tf.reduce_sum(tf.cast(losses, tf.float64))[tf.newaxis], confusion], axis=0)
+
+        def replica_fn(metrics):
+            context = tf.distribute.get_replica_context()
+            # every replica of a worker holds the worker's sums, only its first one adds them
+            first = context.replica_id_in_sync_group % replicas_per_worker == 0
+            return context.all_reduce(tf.distribute.ReduceOp.SUM, tf.where(first, metrics, tf.zeros_like(metrics)))
+
+        @tf.function
+        def all_reduce(metrics):
+            return self.strategy.run(replica_fn, args=(metrics,))
+
+        self._batch_metrics = batch_metrics
+        self._all_reduce = all_reduce
+
+
+def add_evaluation_arguments(parser):
+    parser.add_argument(
+        '--eval-every',
+        required=False,
+        default=1,
+        type=int,
+        metavar='EPOCHS',
+        help='evaluate on the test set split across all workers after every this many epochs; 0 disables, '
+             'default: 1',
+    )
+    parser.add_argument(
+        '--eval-batch-size',
+        required=False,
+        default=1000,
+        type=int,
+        metavar='COUNT',
+        help='the batch size of each worker during evaluation, default: 1000',
+    )
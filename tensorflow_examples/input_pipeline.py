@@ -0,0 +1,157 @@
+import functools
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from shard_format import ShardWriter, prepare_shards, read_index
+
+MNIST_FIELDS = [('image', 'uint8', (28, 28)), ('label', 'int64', ())]
+
+
+def load_mnist(train=True):
+    """Return the MNIST training, or test, images as `uint8` and labels as `int64` NumPy arrays."""
+    training, test = tf.keras.datasets.mnist.load_data()
+    images, labels = training if train else test
+    return images, labels.astype(np.int64)
+
+
+def _normalize(images, labels):
+    return tf.cast(images, tf.float32) / 255.0, labels
+
+
+def mnist_dataset(images, labels, global_batch_size, input_context, shuffle_buffer=10000):
+    """
+    Build the input pipeline of one worker for `strategy.distribute_datasets_from_function()`.
+
+    Every input pipeline reads its own shard of the examples, caches it as compact `uint8`,
+    shuffles it with a buffer of at most `shuffle_buffer` examples and batches it to the per replica
+    batch size. Images are converted to floats once per batch instead of once per example, and the
+    next batches are prepared while the current one trains.
+    """
+    batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    dataset = dataset.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+    dataset = dataset.cache()
+    dataset = dataset.shuffle(shuffle_buffer).repeat()
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = dataset.map(_normalize, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def evaluation_dataset(images, labels, batch_size, worker, workers):
+    """Batch every `workers`-th example starting from `worker`, so the workers split the set without overlap."""
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    dataset = dataset.shard(workers, worker)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(_normalize, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def write_mnist_shards(directory, shard_size_mb=4):
+    images, labels = load_mnist()
+    with ShardWriter(directory, MNIST_FIELDS, shard_size_mb=shard_size_mb) as writer:
+        writer.write(image=images, label=labels)
+
+
+def _decode_records(records, fields):
+    # a batch of fixed-length records as one uint8 matrix, with every field a range of its columns
+    raw = tf.io.decode_raw(records, tf.uint8)
+    values = {}
+    offset = 0
+    for field in fields:
+        dtype = tf.as_dtype(np.dtype(field['dtype']).newbyteorder('='))
+        count = math.prod(field['shape'])
+        column = raw[:, offset:offset + count * dtype.size]
+        if dtype != tf.uint8:
+            # the shards are little-endian, as is every platform TensorFlow runs on
+            column = tf.bitcast(tf.reshape(column, [-1, count, dtype.size]), dtype)
+        values[field['name']] = tf.reshape(column, [-1, *field['shape']])
+        offset += count * dtype.size
+    return values
+
+
+def _decode_mnist(records, fields):
+    values = _decode_records(records, fields)
+    return _normalize(values['image'], values['label'])
+
+
+def sharded_mnist_dataset(directory, global_batch_size, input_context, shuffle_buffer=10000, read_ahead_mb=4):
+    """
+    Build the input pipeline of one worker that streams MNIST from `shard_format` shards in `directory`.
+
+    Every input pipeline reads its own shards, in a new order every epoch, a few at a time with
+    `tf.data.FixedLengthRecordDataset` reading `read_ahead_mb` ahead in each, and shuffles the records
+    through a buffer of `shuffle_buffer` records, so memory use doesn't grow with the size of the dataset.
+    """
+    index = read_index(directory)
+    paths = [os.path.join(directory, shard['file']) for shard in index['shards']]
+    if len(paths) < input_context.num_input_pipelines:
+        raise ValueError(f'{len(paths)} shards cannot be split between {input_context.num_input_pipelines} '
+                         f'input pipelines, write smaller shards')
+    batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    dataset = dataset.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+    dataset = dataset.shuffle(len(paths)).repeat()
+    dataset = dataset.interleave(
+        lambda path: tf.data.FixedLengthRecordDataset(
+            path,
+            index['record_bytes'],
+            buffer_size=int(read_ahead_mb * 1024 * 1024),
+        ),
+        cycle_length=4,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=False,
+    )
+    dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = dataset.map(functools.partial(_decode_mnist, fields=index['fields']), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def mnist_dataset_fn(settings, global_batch_size):
+    """Return the dataset function for `strategy.distribute_datasets_from_function()` the settings ask for."""
+    if settings.data_source == 'shards':
+        prepare_shards(settings.shard_dir, write_mnist_shards)
+        return lambda input_context: sharded_mnist_dataset(
+            settings.shard_dir,
+            global_batch_size,
+            input_context,
+            shuffle_buffer=settings.shuffle_buffer,
+        )
+    images, labels = load_mnist()
+    return lambda input_context: mnist_dataset(
+        images,
+        labels,
+        global_batch_size,
+        input_context,
+        shuffle_buffer=settings.shuffle_buffer,
+    )
+
+
+def add_input_arguments(parser):
+    parser.add_argument(
+        '--shuffle-buffer',
+        required=False,
+        default=10000,
+        type=int,
+        metavar='COUNT',
+        help='how many examples each worker shuffles at a time, default: 10000',
+    )
+    parser.add_argument(
+        '--data-source',
+        required=False,
+        default='memory',
+        choices=['memory', 'shards'],
+        help='load MNIST into memory on every worker, or write it once into binary shards and stream those, '
+             'default: memory',
+    )
+    parser.add_argument(
+        '--shard-dir',
+        required=False,
+        default='./data/mnist-shards',
+        metavar='DIRECTORY',
+        help='where MNIST is written as binary shards and streamed from with --data-source shards, '
+             'default: ./data/mnist-shards',
+    )
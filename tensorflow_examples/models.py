@@ -0,0 +1,49 @@
+import tensorflow as tf
+
+
+def set_precision(precision):
+    """Build the following models in float32, or compute in bfloat16 with float32 variables for `bf16`."""
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16' if precision == 'bf16' else 'float32')
+
+
+def build_and_compile_cnn_model(gradient_aggregator=None, jit_compile=False):
+    if gradient_aggregator is None:
+        optimizer = tf.keras.optimizers.SGD(learning_rate=0.001)
+    else:
+        # only the original Keras optimizers take a gradient aggregator, newer releases keep them in `legacy`
+        optimizers = getattr(tf.keras.optimizers, 'legacy', tf.keras.optimizers)
+        optimizer = optimizers.SGD(learning_rate=0.001, gradient_aggregator=gradient_aggregator)
+    model = tf.keras.Sequential([
+        tf.keras.layers.InputLayer(input_shape=(28, 28)),
+        tf.keras.layers.Reshape(target_shape=(28, 28, 1)),
+        tf.keras.layers.Conv2D(32, 3, activation='relu'),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dense(10),
+        # keep the logits and the loss in float32 when computing in bfloat16
+        tf.keras.layers.Activation('linear', dtype='float32'),
+    ])
+    model.compile(
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+        optimizer=optimizer,
+        metrics=['accuracy'],
+        jit_compile=jit_compile,
+    )
+    return model
+
+
+def add_model_arguments(parser):
+    parser.add_argument(
+        '--precision',
+        required=False,
+        default='fp32',
+        choices=['fp32', 'bf16'],
+        help='compute in float32 or with the mixed_bfloat16 Keras policy, default: fp32',
+    )
+    parser.add_argument(
+        '--jit-compile',
+        required=False,
+        default=False,
+        action='store_true',
+        help='compile the training step with XLA',
+    )
@@ -0,0 +1,175 @@
+import os
+import time
+
+import tensorflow as tf
+import valohai
+
+PHASES = ['step', 'between_steps']
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def find_stragglers(step_times, threshold):
+    """Return the workers whose step time is more than `threshold` times the median of all workers."""
+    median_time = median(step_times)
+    return [worker for worker, step_time in enumerate(step_times) if step_time > median_time * threshold]
+
+
+class StepProfiler(tf.keras.callbacks.Callback):
+    """
+    Time every training step and compare the times across workers every `log_every` steps.
+
+    Keras runs the input pipeline, the forward and backward passes, the all-reduce and the optimizer as one
+    compiled step, so only the step itself and the time between two steps of an epoch (callbacks, logging and
+    any other Python work) can be told apart from here; `trace_steps` records a TensorFlow profiler trace into
+    `trace_dir` that breaks the selected steps down further.
+    Every `log_every` steps, the average times of all workers are all-gathered as one small tensor and the
+    chief logs their median and maximum; a worker slower than `straggler_threshold` times the median step
+    for `straggler_windows` windows in a row is reported as a straggler.
+    """
+
+    def __init__(
+        self,
+        strategy,
+        log_every=100,
+        straggler_threshold=1.2,
+        straggler_windows=3,
+        trace_steps=(),
+        trace_dir='/valohai/outputs/traces',
+    ):
+        super().__init__()
+        self.strategy = strategy
+        self.log_every = log_every
+        self.straggler_threshold = straggler_threshold
+        self.straggler_windows = straggler_windows
+        self.trace_steps = set(trace_steps)
+        self.trace_dir = trace_dir
+        self.totals = [0.0] * len(PHASES)
+        self.steps = 0
+        self.step = 0
+        self.slow_windows = None
+        self._tracing = False
+        self._gather = None
+        self._last_end = None
+        self._started = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._started = time.perf_counter()
+        if self._last_end is not None:
+            self.totals[1] += self._started - self._last_end
+        if not self._tracing and self.step + 1 in self.trace_steps:
+            tf.profiler.experimental.start(os.path.join(self.trace_dir, f'worker-{self._worker_index()}'))
+            self._tracing = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.totals[0] += time.perf_counter() - self._started
+        self.steps += 1
+        self.step += 1
+        if self._tracing and self.step + 1 not in self.trace_steps:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+        if self.step % self.log_every == 0:
+            self._report()
+        self._last_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        # evaluation, backups and other end-of-epoch work of some workers only is no time between steps
+        self._last_end = None
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+
+    def _worker_index(self):
+        return self.strategy.cluster_resolver.task_id or 0
+
+    def _worker_count(self):
+        return len(self.strategy.cluster_resolver.cluster_spec().as_dict().get('worker', [])) or 1
+
+    def _build(self):
+
+        def replica_fn(averages):
+            return tf.distribute.get_replica_context().all_gather(averages[tf.newaxis], axis=0)
+
+        @tf.function
+        def gather(averages):
+            return self.strategy.run(replica_fn, args=(averages,))
+
+        return gather
+
+    def _report(self):
+        if self._gather is None:
+            self._gather = self._build()
+        averages = tf.constant(self.totals, dtype=tf.float64) / max(1, self.steps)
+        gathered = self.strategy.experimental_local_results(self._gather(averages))[0].numpy()
+        self.totals = [0.0] * len(PHASES)
+        self.steps = 0
+
+        # every replica of a worker reports the same times and replicas are in worker order, keep one per worker
+        times = gathered[::self.strategy.num_replicas_in_sync // self._worker_count()]
+        step_times = times.sum(axis=1).tolist()
+        slow = set(find_stragglers(step_times, self.straggler_threshold))
+        if self.slow_windows is None:
+            self.slow_windows = [0] * len(step_times)
+        self.slow_windows = [count + 1 if worker in slow else 0 for worker, count in enumerate(self.slow_windows)]
+        stragglers = [worker for worker, count in enumerate(self.slow_windows) if count >= self.straggler_windows]
+        if self._worker_index() != 0:
+            return
+        with valohai.logger() as logger:
+            logger.log('step', self.step)
+            for phase, phase_times in zip(PHASES, times.T.tolist()):
+                logger.log(f'{phase}_ms_median', median(phase_times) * 1000)
+                logger.log(f'{phase}_ms_max', max(phase_times) * 1000)
+            logger.log('slowest_worker', max(range(len(step_times)), key=lambda worker: step_times[worker]))
+            logger.log('stragglers', stragglers)
+        if stragglers:
+            print(f'Step {self.step}: workers {stragglers} have been over {self.straggler_threshold}x the median '
+                  f'step time for {self.straggler_windows} reports in a row')
+
+
+def parse_steps(value):
+    """Parse a step selection such as `50-55,100` into a list of steps."""
+    steps = []
+    for part in value.split(','):
+        first, _, last = part.partition('-')
+        steps.extend(range(int(first), int(last or first) + 1))
+    return steps
+
+
+def add_profiling_arguments(parser):
+    parser.add_argument(
+        '--profile-every',
+        required=False,
+        default=100,
+        type=int,
+        metavar='STEPS',
+        help='how often step timings are gathered from all workers and logged; 0 disables, default: 100',
+    )
+    parser.add_argument(
+        '--straggler-threshold',
+        required=False,
+        default=1.2,
+        type=float,
+        metavar='RATIO',
+        help='flag workers whose step time is this many times the median for 3 reports in a row, default: 1.2',
+    )
+    parser.add_argument(
+        '--trace-steps',
+        required=False,
+        default=[],
+        type=parse_steps,
+        metavar='STEPS',
+        help='steps to record with the TensorFlow profiler, e.g. 50-55, default: none',
+    )
+    parser.add_argument(
+        '--trace-dir',
+        required=False,
+        default='/valohai/outputs/traces',
+        metavar='DIRECTORY',
+        help='where profiler traces are written, default: /valohai/outputs/traces',
+    )